@@ -5,7 +5,6 @@ import argparse
 from tex_timelapse.reporters.terminal_reporter import TerminalReporter
 from tex_timelapse.compiler import compileProject
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import SnapshotStatus
 from tex_timelapse.webserver import WebServer
 
 
@@ -53,7 +52,7 @@ runParser.add_argument(
 runParser.add_argument(
     '--stage',
     type=int,
-    help='Start from stage (default: all)')
+    help='Force re-running all snapshots starting from this stage (1: Init Repository, 2: Replace Text, 3: Compile LaTeX, 4: PDF to Image, 5: Assemble Image). By default, only stages with changed config are re-run')
 
 # TODO: non-project-specific general arguments; add these to docker-compose.yml
 # workers: int # TODO: -1 should set to cpu count; 1 should disable multiprocessing
@@ -93,14 +92,10 @@ def runProject(name: str, output: str, args):
     ]
 
     if args.stage is not None:
-        foundStage = False
-
-        for job in jobs:
-            jobName = job.getName()
-            foundStage = jobName == args.stage
-            if foundStage:
-                for snapshot in project.snapshots:
-                    snapshot.status = SnapshotStatus.PENDING
+        # forget results of the given stage and all following stages, so that they are re-run
+        for job in jobs[max(args.stage - 1, 0):]:
+            for snapshot in project.snapshots:
+                snapshot.fingerprints.pop(job.getName(), None)
 
     compileProject(project, output, jobs, TerminalReporter())
 
@@ -115,17 +110,19 @@ def listProjects():
 # Main
 ############################
 
-args = parser.parse_args()
-
-if (args.action == 'init'):
-    Project.create(args.project, args.source)
-elif (args.action == 'run'):
-    runProject(args.project, args.output, args)
-elif (args.action == 'list'):
-    listProjects()
-elif (args.action == 'server'):
-    WebServer().run()
-    
-else:
-    print(f"Unknown action '{args.action}'")
-    parser.print_help()
+# worker processes of the pipeline import this file again, they must not run the command line
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if (args.action == 'init'):
+        Project.create(args.project, args.source)
+    elif (args.action == 'run'):
+        runProject(args.project, args.output, args)
+    elif (args.action == 'list'):
+        listProjects()
+    elif (args.action == 'server'):
+        WebServer().run()
+
+    else:
+        print(f"Unknown action '{args.action}'")
+        parser.print_help()
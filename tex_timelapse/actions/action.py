@@ -21,4 +21,26 @@ class Action(ABC):
 
     @abstractmethod
     def reset(self, snapshot: Snapshot) -> None:
-        pass
\ No newline at end of file
+        pass
+
+    # config keys that influence the result of this action, used to detect outdated results on re-runs
+    def getConfigKeys(self) -> list[str]:
+        return []
+
+    # whether this action depends on the work dir state left behind by the previous actions
+    # (and not only on results that are persisted in the snapshot / project folder)
+    def requiresWorkDir(self) -> bool:
+        return False
+
+    # whether the result of this action is kept after the run, so that it can be skipped on re-runs
+    def isResultPersisted(self, project: Project) -> bool:
+        return True
+
+    # whether the result of an earlier run of this action is still there, e.g. files it refers to were not removed
+    def isResultAvailable(self, snapshot: Snapshot) -> bool:
+        return True
+
+    # whether this action is mostly busy in python code, so that it can be run in worker processes
+    # (actions waiting for external commands are run in threads)
+    def isCpuBound(self) -> bool:
+        return False
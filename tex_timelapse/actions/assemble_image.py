@@ -1,29 +1,16 @@
 import os
+from array import array
 from typing import Tuple
 from tex_timelapse.actions.action import Action
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import Snapshot, SnapshotStatus
-from PIL import Image, ImageFilter, ImageDraw
-from glob import glob
-import numpy as np
+from tex_timelapse.snapshot import Snapshot, SnapshotStatus, BOX_FIELDS, unpackBoxes
+from tex_timelapse.snapshot_cache import SnapshotCache
+from tex_timelapse.page_cache import PageCache
+from tex_timelapse.actions.pdf_to_image import FRAME_WIDTH, FRAME_HEIGHT
+from tex_timelapse.compositor import FrameCompositor
+from PIL import Image, ImageFilter
 from PyPDF2 import PdfReader
 
-# see https://stackoverflow.com/a/46877433/4090817
-def pil_grid(images, max_horiz=np.iinfo(int).max):
-    n_images = len(images)
-    n_horiz = min(n_images, max_horiz)
-    h_sizes, v_sizes = [0] * n_horiz, [0] * ((n_images // n_horiz) + (1 if n_images % n_horiz > 0 else 0))
-    for i, im in enumerate(images):
-        h, v = i % n_horiz, i // n_horiz
-        h_sizes[h] = max(h_sizes[h], im.size[0])
-        v_sizes[v] = max(v_sizes[v], im.size[1])
-    h_sizes, v_sizes = np.cumsum([0] + h_sizes), np.cumsum([0] + v_sizes)
-    im_grid = Image.new('RGB', (h_sizes[-1], v_sizes[-1]), color='white')
-    for i, im in enumerate(images):
-        im_grid.paste(im, (h_sizes[i % n_horiz], v_sizes[i // n_horiz]))
-    return im_grid
-
-
 class AssembleImageAction(Action):
     def getName(self) -> str:
         return 'Assemble Image'
@@ -33,47 +20,71 @@ class AssembleImageAction(Action):
         self.rows = int(project.config['rows'])
         self.columns = int(project.config['columns'])
         self.highlightChanges = bool(project.config['highlightChanges'])
+        self.streamFrames = bool(project.config.get('streamFrames', False))
         self.project_img_dir = f'{project.projectFolder}/frames'
+        self.cache = SnapshotCache(project)
+        self.page_cache = PageCache(project)
 
         os.makedirs(self.project_img_dir, exist_ok=True)
 
     def cleanup(self) -> None:
         pass
 
+    def getConfigKeys(self) -> list[str]:
+        return ['blur', 'rows', 'columns', 'highlightChanges']
+
+    def isResultPersisted(self, project: Project) -> bool:
+        # streamed frames are only kept in memory until they are passed to ffmpeg
+        return not project.config.get('streamFrames', False)
+
+    def isCpuBound(self) -> bool:
+        return True
+
     def run(self, snapshot: Snapshot) -> str:
-        workDir = snapshot.getWorkDir()
-        rawImages = sorted(snapshot.pages)
+        rawImages = list(snapshot.pages)
 
         # Retrieve image size from the first image
         image_size = Image.open(rawImages[0]).size
         image_width, image_height = image_size
 
         # Check if the resulting image size is too large to downscale images as needed
+        # (pages are usually already rendered at the right size by PdfToImageAction)
         scale = 1.0
-        if image_width * self.columns > 1920 or image_height * self.rows > 1080:
-            scale = min(1920.0 / (image_width * self.columns), 1080.0 / (image_height * self.rows))
+        if image_width * self.columns > FRAME_WIDTH or image_height * self.rows > FRAME_HEIGHT:
+            scale = min(float(FRAME_WIDTH) / (image_width * self.columns), float(FRAME_HEIGHT) / (image_height * self.rows))
             image_size = (int(image_width * scale), int(image_height * scale))
             image_width, image_height = image_size
 
-        if self.blur > 0:
-            images = [Image.open(i).resize(image_size, Image.Resampling.NEAREST).filter(ImageFilter.GaussianBlur(self.blur)) for i in rawImages]
-        else:
-            images = [Image.open(i).resize(image_size, Image.Resampling.NEAREST) for i in rawImages]
+        # resized and blurred pages are shared with other snapshots through the page cache
+        page_keys = self.cache.getPageKeys(snapshot.cache_key)
+        if len(page_keys) != len(rawImages):
+            page_keys = []
 
-        if (len(images) == 0):
+        # Remove unnecessary pages that wouldn't fit in the frame, missing pages stay white
+        rawImages = rawImages[:self.rows * self.columns]
+        if (len(rawImages) == 0):
             raise Exception(f'No images found for {snapshot.commit_sha}')
 
-        # Fill array with empty images if there are not enough pages
-        while (len(images) < self.rows * self.columns):
-            images.append(Image.new('RGB', image_size, color='white'))
-        # Remove unnecessary pages that wouldn't fit in the frame
-        while ((len(images)) > self.rows * self.columns):
-            images.pop()
+        compositor = FrameCompositor.get(self.rows, self.columns, image_size)
+        compositor.clear()
+
+        for i, rawImage in enumerate(rawImages):
+            tile_key = PageCache.getTileKey(page_keys[i], image_size, self.blur) if len(page_keys) > 0 else None
+            tile = self.page_cache.get(tile_key, '.png') if tile_key is not None else None
+            if tile is not None:
+                with Image.open(tile) as image:
+                    compositor.paste(i, image)
+                continue
 
-        # images for drawing overlays
-        drawImages = []
-        for i in range(len(images)):
-            drawImages.append(Image.new('RGBA', images[i].size, '#FFFFFF00'))
+            with Image.open(rawImage) as page:
+                image = page.resize(image_size, Image.Resampling.NEAREST)
+            if self.blur > 0:
+                image = image.filter(ImageFilter.GaussianBlur(self.blur))
+
+            if tile_key is not None:
+                self.page_cache.storeImage(image, tile_key, '.png')
+
+            compositor.paste(i, image)
 
         # Image crop - only works for ACM single column template
         # for i in range(len(images)):
@@ -84,43 +95,48 @@ class AssembleImageAction(Action):
 
         if self.highlightChanges:
 
-            texFile = snapshot.main_tex_file
-            pdfFile = texFile[:-4] + '.pdf'
-            pdf_size = self.get_pdf_dimensions(f'{workDir}/{pdfFile}')
+            pdf_size = self.get_pdf_dimensions(self.cache.getPdfPath(snapshot.cache_key))
+            page_count = self.rows * self.columns
+
+            boxes = list(unpackBoxes(snapshot.changed_boxes, BOX_FIELDS))
 
             # highlight entire pages first
-            for synctexInfo in snapshot.changed_pages:
-                page_num = int(synctexInfo['page'])
-                if page_num and page_num <= len(drawImages):
-                    drawImages[page_num - 1] = Image.new('RGBA', images[0].size, '#A3BE8C44')
+            for synctexInfo in boxes:
+                page_num = int(synctexInfo[0])
+                if page_num and page_num <= page_count:
+                    compositor.highlightPage(page_num - 1)
 
             # draw in more detailed changes
-            for synctexInfo in snapshot.changed_pages:
-                page_num = int(synctexInfo['page'])
+            highlight_boxes = array('f')
+            for synctexInfo in boxes:
+                page_num = int(synctexInfo[0])
 
                 x, y, h, v, W, H = self.convert_synctex_to_image_coords(pdf_size, image_size, synctexInfo)
 
                 padding = image_width // 10
 
                 # for webui
-                synctexInfo['x1'] = float(h - padding) / float(image_width)
-                synctexInfo['y1'] = float(v - padding) / float(image_height)
-                synctexInfo['x2'] = float(h + W + padding) / float(image_width)
-                synctexInfo['y2'] = float(v + H + padding) / float(image_height)
-
-                if not page_num or page_num > len(drawImages):
+                highlight_boxes.extend((
+                    float(h - padding) / float(image_width),
+                    float(v - padding) / float(image_height),
+                    float(h + W + padding) / float(image_width),
+                    float(v + H + padding) / float(image_height),
+                ))
+
+                if not page_num or page_num > page_count:
                     continue
 
-                draw = ImageDraw.Draw(drawImages[page_num - 1])
-                draw.rectangle((h - padding, v - padding, h + W + padding, v + H + padding), fill = '#81A1C144')
+                compositor.highlightBox(page_num - 1, h - padding, v - padding, h + W + padding, v + H + padding)
 
+            snapshot.highlight_boxes = highlight_boxes
 
             # combine overlays
-            for i in range(len(images)):
-                images[i] = Image.alpha_composite(images[i].convert('RGBA'), drawImages[i])
+            compositor.blendHighlights()
 
-        img = pil_grid(images, self.columns)
-        img.save(f'{self.project_img_dir}/frame_{snapshot.index:09d}.png')
+        if self.streamFrames:
+            snapshot.frame = compositor.toImage()
+        else:
+            compositor.save(f'{self.project_img_dir}/frame_{snapshot.index:09d}.png')
 
         return SnapshotStatus.COMPLETED
 
@@ -157,11 +173,14 @@ class AssembleImageAction(Action):
         x_ratio = image_width / pdf_width
         y_ratio = image_height / pdf_height
 
-        x = int(synctex_coords['x'] * x_ratio)
-        y = image_height - int(synctex_coords['y'] * y_ratio)  # Invert y-coordinate
-        h = int(synctex_coords['h'] * y_ratio)
-        v = int(synctex_coords['v'] * x_ratio)
-        W = int(synctex_coords['W'] * x_ratio)
-        H = int(synctex_coords['H'] * y_ratio)
+        # fields as in BOX_FIELDS
+        _, sx, sy, sh, sv, sW, sH = synctex_coords
+
+        x = int(sx * x_ratio)
+        y = image_height - int(sy * y_ratio)  # Invert y-coordinate
+        h = int(sh * y_ratio)
+        v = int(sv * x_ratio)
+        W = int(sW * x_ratio)
+        H = int(sH * y_ratio)
 
         return x, y, h, v, W, H
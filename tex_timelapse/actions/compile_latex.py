@@ -1,9 +1,15 @@
 from typing import Dict, Set
 from tex_timelapse.actions.action import Action
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import Snapshot, SnapshotStatus
-import re
+from tex_timelapse.snapshot import Snapshot, SnapshotStatus, packBoxes
+from tex_timelapse.snapshot_cache import SnapshotCache
+from tex_timelapse.preamble_format import PreambleFormatCache
+from tex_timelapse.package_cache import PackageCache
+from tex_timelapse.bibliography_cache import BibliographyCache
+from tex_timelapse.synctex import SynctexIndex
+from array import array
 import os
+import shlex
 
 class CompileLatexAction(Action):
     def getName(self) -> str:
@@ -11,49 +17,72 @@ class CompileLatexAction(Action):
 
     def init(self, project: Project) -> None:
         self.latexCmd = project.config['latexCmd']
-        # TODO: texliveonfly?
-        pass
+        self.cache = SnapshotCache(project)
+        self.packages = PackageCache(project)
+        self.preambleFormats = PreambleFormatCache(project) if project.config.get('precompilePreamble', False) else None
+        # only latexmk runs bibtex / biber itself
+        usesLatexmk = shlex.split(self.latexCmd)[:1] == ['latexmk']
+        self.bibliographies = BibliographyCache(project) if project.config.get('reuseBibliography', True) and usesLatexmk else None
 
     def cleanup(self) -> None:
         pass
 
+    def getConfigKeys(self) -> list[str]:
+        return ['latexCmd']
+
+    def requiresWorkDir(self) -> bool:
+        return True
+
     def run(self, snapshot: Snapshot) -> str:
         workDir = snapshot.getWorkDir()
         texFile = snapshot.main_tex_file
-        installCmd = f'texliveonfly {texFile}'
-
-        # ignore errors in case it somehow still compiled
-        snapshot.execute_cmd(installCmd, ignore_error=True)
-
-        compileCmd = f'{self.latexCmd} {texFile}'
-        # ignore errors in case it somehow still compiled
-        output = snapshot.execute_cmd(compileCmd, ignore_error=True, posix=True)
-
-        # check if the compilation was successful by checking if there's a pdf file
         pdfFile = texFile[:-4] + '.pdf'
-        if not os.path.exists(f'{workDir}/{pdfFile}'):
-            snapshot.error = output
-            return SnapshotStatus.FAILED
-
-        # git format example: @@ -33,5 55,4 @@
-        #                         ^  ^ ^  ^
-        #                         |  | |  |
-        #              Removed Line  | Added line
-        #                            |    |
-        #                      Number of removed / added lines (may be optional)
-        #
+
+        # reuse the pdf of an earlier snapshot with identical document state
+        blobs = SnapshotCache.getBlobHashes(snapshot)
+        snapshot.cache_key = self.cache.getKey(snapshot, blobs)
+        if self.cache.hasPdf(snapshot.cache_key):
+            self.cache.restorePdf(snapshot)
+        else:
+            # install missing packages only for packages that were not resolved for this project before
+            packages = PackageCache.getPackages(f'{workDir}/{texFile}')
+            unresolved = self.packages.getUnresolved(packages)
+            if len(unresolved) > 0:
+                self.installPackages(snapshot, unresolved)
+
+            # -bibtex- makes latexmk use the restored .bbl instead of running bibtex / biber
+            bibliographies = self.bibliographies
+            bibKey = bibliographies.getKey(snapshot, blobs) if bibliographies is not None else None
+            reuseBibliography = bibliographies is not None and bibKey is not None and bibliographies.restore(snapshot, bibKey)
+            output = self.compile(snapshot, blobs, '-bibtex-' if reuseBibliography else '')
+
+            # compile removes the pdf of earlier snapshots first, so a missing pdf means the restored .bbl did not work
+            if reuseBibliography and not os.path.exists(f'{workDir}/{pdfFile}'):
+                reuseBibliography = False
+                output = self.compile(snapshot, blobs)
+
+            # e.g. a package that is loaded by a class or another package
+            if len(unresolved) == 0 and PackageCache.isMissingFileError(output):
+                self.installPackages(snapshot, packages)
+                output = self.compile(snapshot, blobs)
+
+            # check if the compilation was successful by checking if there's a pdf file
+            if not os.path.exists(f'{workDir}/{pdfFile}'):
+                snapshot.error = output
+                return SnapshotStatus.FAILED
+
+            self.cache.storePdf(snapshot)
+            if bibliographies is not None and bibKey is not None and not reuseBibliography:
+                bibliographies.store(snapshot, bibKey)
+
+        # changed lines contain both removed and added lines of the diff, see diffToLineRanges
         changedFiles: Dict[str, Set[int]] = {}
-        for file, diff in snapshot.gitDiff.items():
+        for file, ranges in snapshot.changed_lines.items():
             changedFiles[file] = set()
 
             if file.endswith('.tex'):
-                # The following code extracts these values and puts both removed and added lines into the changedLines array
-                gitDiffResults = re.finditer(r'@@\s+-(\d+),?(\d*)\s+\+(\d+),?(\d*)\s+@@', diff)
-                for match in gitDiffResults:
-                    for x in range(int(match.group(1)), int(match.group(1)) + int(match.group(2) if match.group(2) else 0) + 1):
-                        changedFiles[file].add(x)
-                    for x in range(int(match.group(3)), int(match.group(3)) + int(match.group(4) if match.group(4) else 0) + 1):
-                        changedFiles[file].add(x)
+                for start, end in zip(ranges[::2], ranges[1::2]):
+                    changedFiles[file].update(range(start, end))
             else:
                 # since we might've added a file ending (but \includegraphics doesn't have to have one), we'll remove it again.
                 # TODO: this assumes a file ending of 4 characters, which is not always the case
@@ -80,38 +109,53 @@ class CompileLatexAction(Action):
                     changedFiles[file].add(line)
 
 
+        # convert the git changed lines to pages using synctex
         changesPages = []
-        for file, changedLines in changedFiles.items():
-            # convert the git changed lines to pages using synctex
-            pdfFile = texFile[:-4] + '.pdf'
-            for line in changedLines:
-                filePath = file
-                if not filePath.startswith('./'):
-                    filePath = './' + filePath
-
-                synctexCmd = f'synctex view -i {line}:0:{os.path.abspath(workDir)}/{filePath} -o {pdfFile}'
-                output = snapshot.execute_cmd(synctexCmd)
-
-                pattern = r'Page:(?P<page>\d+)\nx:(?P<x>\d+\.?\d*)\ny:(?P<y>\d+\.?\d*)\nh:(?P<h>\d+\.?\d*)\nv:(?P<v>\d+\.?\d*)\nW:(?P<W>\d+\.?\d*)\nH:(?P<H>\d+\.?\d*)'
-                synctexMatch = re.finditer(pattern, output, flags=re.MULTILINE)
-
-                for m in synctexMatch:
-                    changesPages.append({
-                        'page': int(m.group('page')),
-                        'x': float(m.group('x')),
-                        'y': float(m.group('y')),
-                        'h': float(m.group('h')),
-                        'v': float(m.group('v')),
-                        'W': float(m.group('W')),
-                        'H': float(m.group('H')),
-                    })
-
+        if any(len(changedLines) > 0 for changedLines in changedFiles.values()):
+            synctexFile = SynctexIndex.find(workDir, texFile)
+            if synctexFile is None:
+                raise Exception(f'No synctex file found for {texFile}')
+            changesPages = SynctexIndex(synctexFile, workDir).lookupAll(changedFiles)
 
         # write pages back to file for later processing
-        snapshot.changed_pages = changesPages
+        snapshot.changed_boxes = packBoxes(changesPages)
+        snapshot.highlight_boxes = array('f')
 
         return SnapshotStatus.COMPLETED
 
+    def installPackages(self, snapshot: Snapshot, packages: Set[str]) -> None:
+        installCmd = f'texliveonfly {snapshot.main_tex_file}'
+
+        # ignore errors in case it somehow still compiled
+        snapshot.execute_cmd(installCmd, ignore_error=True)
+        self.packages.markResolved(packages)
+
+    def compile(self, snapshot: Snapshot, blobs: Dict[str, str], latexmkOptions: str = '') -> str:
+        workDir = snapshot.getWorkDir()
+        texFile = snapshot.main_tex_file
+        pdfFile = texFile[:-4] + '.pdf'
+
+        if self.preambleFormats is not None:
+            formatCmd = self.preambleFormats.getCompileCmd(texFile, latexmkOptions)
+            if formatCmd is not None and self.preambleFormats.prepare(snapshot, blobs):
+                self.removeOutput(snapshot)
+                output = snapshot.execute_cmd(formatCmd, ignore_error=True, posix=True)
+                if os.path.exists(f'{workDir}/{pdfFile}'):
+                    return output
+
+        # no format for this preamble, or compiling with it failed
+        self.removeOutput(snapshot)
+        compileCmd = f'{self.latexCmd} {latexmkOptions} {texFile}'
+        # ignore errors in case it somehow still compiled
+        return snapshot.execute_cmd(compileCmd, ignore_error=True, posix=True)
+
+    def removeOutput(self, snapshot: Snapshot) -> None:
+        # the work dir may still contain the pdf of an earlier snapshot, which would be taken for the result of this compile
+        baseName = snapshot.main_tex_file[:-4]
+        for file in [f'{baseName}.pdf', f'{baseName}.synctex.gz']:
+            if os.path.exists(f'{snapshot.getWorkDir()}/{file}'):
+                os.remove(f'{snapshot.getWorkDir()}/{file}')
+
 
     def reset(self, snapshot: Snapshot) -> None:
         # automatically resets due to compilation in temp. runner
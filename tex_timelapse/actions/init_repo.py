@@ -1,6 +1,9 @@
 from tex_timelapse.actions.action import Action
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import Snapshot, SnapshotStatus
+from tex_timelapse.snapshot import Snapshot, SnapshotStatus, diffToLineRanges
+from tex_timelapse.snapshot_cache import SnapshotCache
+from tex_timelapse.latex_scanner import findMainTexFile, findIncludedFiles
+from tex_timelapse.git_diff import getDiffs
 
 
 class InitRepoAction(Action):
@@ -13,114 +16,30 @@ class InitRepoAction(Action):
     def cleanup(self) -> None:
         pass
 
+    def getConfigKeys(self) -> list[str]:
+        return ['concatCommits']
+
     def run(self, snapshot: Snapshot) -> str:
         # workDir = snapshot.getWorkDir()
-        cmd = f'git reset --hard {snapshot.commit_sha}'
+        # force discards modifications from previous snapshots, untracked files (e.g., latex aux files) are kept
+        cmd = f'git checkout --detach --force {snapshot.commit_sha}'
         snapshot.execute_cmd(cmd)
 
-        snapshot.main_tex_file = self.findMainTexFile(snapshot)
-        snapshot.includes = self.findIncludedFiles(snapshot)
+        # scan files in-process, unchanged files are only parsed once per run (based on their git blob hash)
+        blobs = SnapshotCache.getBlobHashes(snapshot)
+        snapshot.main_tex_file = findMainTexFile(snapshot.getWorkDir(), blobs)
+        snapshot.includes = findIncludedFiles(snapshot.getWorkDir(), blobs, snapshot.main_tex_file)
 
         diffHistory = 1 if self.concatCommits <= 0 else self.concatCommits
 
         # check for any changes to highlight them in the final output
-        for file in snapshot.includes:
-            diffCmd = f'git diff --unified=0 HEAD HEAD~{diffHistory} {file}'
-            diffOutput = snapshot.execute_cmd(diffCmd, ignore_error=True)
-            if diffOutput != "":
-                snapshot.gitDiff[file] = diffOutput
+        diffs = getDiffs(snapshot, snapshot.includes, diffHistory)
+        snapshot.parent_diffs = None
+        snapshot.changed_lines = { file: diffToLineRanges(diff) for file, diff in diffs.items() }
 
         return SnapshotStatus.COMPLETED
 
 
-    def findMainTexFile(self, snapshot: Snapshot) -> str:
-        result = snapshot.execute_cmd('find . -name *.tex -exec grep -l \\\\begin{document} {} +')
-        if result == "":
-            raise Exception("Could not find main .tex file")
-
-        # use the first line as result
-        result = result.splitlines()[0]
-
-        return result.strip()
-
-
-
-    # TODO: consider more commands, e.g. \bibliography{...}, \addbibresource{...}, \lstinputlisting{...}
-    def findIncludedFiles(self, snapshot: Snapshot) -> list[str]:
-        included_files = [ snapshot.main_tex_file ]
-        unscanned_files = [ snapshot.main_tex_file ]
-
-        while len(unscanned_files) > 0:
-            new_files = []
-
-            resultInclude = snapshot.execute_cmd('grep -r \\\\include{ ' + unscanned_files[0], ignore_error=True)
-            for line in resultInclude.splitlines():
-                # ingore commented files
-                if line.strip().startswith('%'):
-                    continue
-
-                # extract file name
-                file = line.split('{')[1].split('}')[0]
-                if not file.endswith('.tex'):
-                    file += '.tex'
-                new_files.append(file.strip())
-
-            resultInput = snapshot.execute_cmd('grep -r \\\\input{ ' + unscanned_files[0], ignore_error=True)
-            for line in resultInput.splitlines():
-                # ingore commented files
-                if line.strip().startswith('%'):
-                    continue
-
-                # extract file name
-                file = line.split('{')[1].split('}')[0]
-                if not file.endswith('.tex'):
-                    file += '.tex'
-                new_files.append(file.strip())
-
-            resultBibliography = snapshot.execute_cmd('grep -r \\\\addbibresource{ ' + unscanned_files[0], ignore_error=True)
-            for line in resultBibliography.splitlines():
-                # ingore commented files
-                if line.strip().startswith('%'):
-                    continue
-
-                # extract file name
-                file = line.split('{')[1].split('}')[0]
-                if not file.endswith('.bib'):
-                    file += '.bib'
-                new_files.append(file.strip())
-
-            resultGraphics = snapshot.execute_cmd('grep -r \\\\includegraphics ' + unscanned_files[0], ignore_error=True)
-            for line in resultGraphics.splitlines():
-                # ingore commented files
-                if line.strip().startswith('%'):
-                    continue
-
-                # find index of 'includegraphics'
-                idx = line.find('\\includegraphics')
-
-                # extract file name
-                file = line[idx:].split('{')[1].split('}')[0]
-
-                # for images, we might need to add the extension
-                has_extension = file.find('.') != -1
-                if has_extension:
-                    new_files.append(file.strip())
-                else:
-                    possible_files = snapshot.execute_cmd(f'find . -wholename *{file}.*')
-                    for pf in possible_files.splitlines():
-                        new_files.append(pf.strip())
-
-            for file in new_files:
-                if file not in included_files:
-                    included_files.append(file)
-
-                    if file.endswith('.tex'):
-                        unscanned_files.append(file)
-
-            unscanned_files.remove(unscanned_files[0])
-        
-        return included_files
-
     def reset(self, snapshot: Snapshot) -> None:
-        snapshot.gitDiff = {}
+        snapshot.changed_lines = {}
         snapshot.includes = []
@@ -1,9 +1,26 @@
 from glob import glob
 import os
-from shutil import rmtree
+import re
+import tempfile
+from shutil import copyfile, rmtree
+from typing import List, Tuple
+from PIL import Image
+from PyPDF2 import PdfReader
 from tex_timelapse.actions.action import Action
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import Snapshot, SnapshotStatus
+from tex_timelapse.snapshot import Snapshot, SnapshotStatus, getPageName
+from tex_timelapse.snapshot_cache import SnapshotCache
+from tex_timelapse.page_cache import PageCache
+from tex_timelapse.sprite_sheet import createSpriteSheet
+
+# resolution of pdftoppm's default output, pages are only rendered smaller if the frame would get too large
+RASTER_DPI = 150
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+THUMBNAIL_SIZE = 300
+PAGE_NUMBER_PATTERN = re.compile(r'-(\d+)\.jpg$')
+# files stored in the page cache for each rasterized page
+RASTER_SUFFIXES = ['.jpg', '.thumbnail.jpg']
 
 class PdfToImageAction(Action):
     def getName(self) -> str:
@@ -11,41 +28,114 @@ class PdfToImageAction(Action):
 
     def init(self, project: Project) -> None:
         self.project_thumbnail_dir = f'{project.projectFolder}/thumbnails'
-        pass
+        self.rows = int(project.config['rows'])
+        self.columns = int(project.config['columns'])
+        self.cache = SnapshotCache(project)
+        self.page_cache = PageCache(project)
+
+    def getConfigKeys(self) -> list[str]:
+        return ['rows', 'columns']
 
     def cleanup(self) -> None:
         pass
 
+    def isResultAvailable(self, snapshot: Snapshot) -> bool:
+        # pages are referenced in the page cache, which may have evicted them since the last run
+        return all(os.path.exists(page) for page in snapshot.pages)
+
     def run(self, snapshot: Snapshot) -> str:
-        # reset folder
-        snapshot_img_dir = f'{snapshot.getWorkDir()}/images'
-        rmtree(snapshot_img_dir, ignore_errors=True)
-        os.makedirs(snapshot_img_dir, exist_ok=True)
+        # rasterize pdf only if the pages of this document state are not cached (anymore)
+        raster_keys = self.cache.getPageKeys(snapshot.cache_key)
+        entries = [self.page_cache.getEntry(key, RASTER_SUFFIXES) for key in raster_keys]
+        if len(raster_keys) == 0 or any(entry is None for entry in entries):
+            # the pdf is read from the cache, so the work dir of the snapshot may already be used by another snapshot
+            os.makedirs(self.cache.cacheDir, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=self.cache.cacheDir)
+            try:
+                raster_keys = self.rasterize(snapshot, tmp_dir)
+            finally:
+                rmtree(tmp_dir, ignore_errors=True)
+            entries = [self.page_cache.getEntry(key, RASTER_SUFFIXES) for key in raster_keys]
 
-        # convert PDF to images
-        pdfFile = snapshot.main_tex_file[:-4] + '.pdf'
-        cmd = f'pdftoppm -jpeg {pdfFile} images/page'
-        snapshot.execute_cmd(cmd)
+        pages: List[str] = []
+        thumbnails: List[str] = []
+        for entry in entries:
+            if entry is None:
+                raise Exception(f'Pages of {snapshot.commit_sha} were removed from the page cache')
+            pages.append(entry[0])
+            thumbnails.append(entry[1])
 
+        # copy thumbnails for the web UI, also combined into one image
+        os.makedirs(self.project_thumbnail_dir, exist_ok=True)
+        tmp_thumbnail_dir = tempfile.mkdtemp(dir=self.project_thumbnail_dir)
+        try:
+            for i, thumbnail in enumerate(thumbnails):
+                copyfile(thumbnail, f'{tmp_thumbnail_dir}/{getPageName(i, len(thumbnails))}')
+            createSpriteSheet(tmp_thumbnail_dir)
 
-        # generate thumbnails for web UI
-        thumbnail_dir = f'{snapshot.getWorkDir()}/thumbnails'
-        rmtree(thumbnail_dir, ignore_errors=True)
-        os.makedirs(thumbnail_dir, exist_ok=True)
+            thumbnail_save_dir = f'{self.project_thumbnail_dir}/{snapshot.commit_sha}'
+            rmtree(thumbnail_save_dir, ignore_errors=True)
+            os.rename(tmp_thumbnail_dir, thumbnail_save_dir)
+        finally:
+            rmtree(tmp_thumbnail_dir, ignore_errors=True)
 
-        cmd = f'pdftoppm -jpeg -scale-to 300 {pdfFile} thumbnails/page'
-        snapshot.execute_cmd(cmd)
+        # save pages for use in the webserver / later steps, in page order
+        snapshot.pages = pages
 
-        # move thumbnails
-        thumbnail_save_dir = f'{self.project_thumbnail_dir}/{snapshot.commit_sha}'
-        rmtree(thumbnail_save_dir, ignore_errors=True)
-        os.makedirs(thumbnail_save_dir, exist_ok=True)
-        os.rename(thumbnail_dir, thumbnail_save_dir)
+        return SnapshotStatus.COMPLETED
 
-        # save pages for use in the webserver / later steps
-        snapshot.pages = [filename for filename in glob(f'{snapshot_img_dir}/*.jpg')]
+    def rasterize(self, snapshot: Snapshot, tmp_dir: str) -> List[str]:
+        pdfFile = os.path.abspath(self.cache.getPdfPath(snapshot.cache_key))
+        with open(pdfFile, 'rb') as f:
+            reader = PdfReader(f)
+            size = self.getPageSize(reader)
+            # only the pages that fit into the frame are needed
+            raster_keys = [PageCache.getRasterKey(h, size) for h in PageCache.getPageHashes(reader, self.rows * self.columns)]
 
-        return SnapshotStatus.COMPLETED
+        # render pages that are not in the page cache yet, directly at the size they are shown
+        render_dir = f'{tmp_dir}/render'
+        os.makedirs(render_dir, exist_ok=True)
+
+        missing_pages = [i + 1 for i, key in enumerate(raster_keys) if self.page_cache.getEntry(key, RASTER_SUFFIXES) is None]
+        for first, last in self.getPageRanges(missing_pages):
+            cmd = f'pdftoppm -jpeg -f {first} -l {last} -scale-to-x {size[0]} -scale-to-y {size[1]} {pdfFile} render/page'
+            snapshot.execute_cmd(cmd, cwd=tmp_dir)
+
+        for page in glob(f'{render_dir}/*.jpg'):
+            match = PAGE_NUMBER_PATTERN.search(page)
+            if match is None:
+                raise Exception(f'Unexpected page file {page} of {snapshot.commit_sha}')
+            key = raster_keys[int(match.group(1)) - 1]
+            self.page_cache.store(page, key, '.jpg')
+
+            # generate thumbnails for web UI from the rendered pages
+            with Image.open(page) as img:
+                img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                self.page_cache.storeImage(img, key, '.thumbnail.jpg')
+
+        # the pages themselves are only kept in the page cache, so that its size limit applies to them
+        self.cache.storePageKeys(snapshot.cache_key, raster_keys)
+        return raster_keys
+
+    def getPageRanges(self, pages: List[int]) -> List[Tuple[int, int]]:
+        # consecutive pages are rendered with a single call
+        ranges: List[Tuple[int, int]] = []
+        for page in pages:
+            if len(ranges) > 0 and ranges[-1][1] == page - 1:
+                ranges[-1] = (ranges[-1][0], page)
+            else:
+                ranges.append((page, page))
+        return ranges
+
+    def getPageSize(self, reader: PdfReader) -> Tuple[int, int]:
+        # all pages are shown at the size of the first page
+        media_box = reader.pages[0].mediabox
+        pdf_width = float(media_box.right - media_box.left)
+        pdf_height = float(media_box.top - media_box.bottom)
+
+        # pdf sizes are in points (1/72 inch)
+        scale = min(RASTER_DPI / 72.0, FRAME_WIDTH / (pdf_width * self.columns), FRAME_HEIGHT / (pdf_height * self.rows))
+        return max(1, int(pdf_width * scale)), max(1, int(pdf_height * scale))
 
     def reset(self, snapshot: Snapshot) -> None:
         snapshot.pages = []
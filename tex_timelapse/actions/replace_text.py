@@ -15,6 +15,12 @@ class ReplaceTextAction(Action):
     def cleanup(self) -> None:
         pass
 
+    def getConfigKeys(self) -> list[str]:
+        return ['text_replacements']
+
+    def requiresWorkDir(self) -> bool:
+        return True
+
     def run(self, snapshot: Snapshot) -> str:
         work_dir = snapshot.getWorkDir()
 
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+from typing import Dict, List, Optional
+
+from tex_timelapse.latex_scanner import COMMENT_PATTERN
+from tex_timelapse.project import Project
+from tex_timelapse.snapshot import Snapshot
+from tex_timelapse.snapshot_cache import SUPPORT_FILE_EXTENSIONS
+
+# \cite, \citep, \nocite, \parencite, \textcite, ... with optional arguments
+CITE_PATTERN = re.compile(r'\\[a-zA-Z]*cite[a-zA-Z]*\*?\s*(?:\[[^\]]*\]\s*)*\{([^}]*)\}')
+# commands that change the formatting of the bibliography
+BIB_SETTINGS_PATTERN = re.compile(r'\\bibliographystyle\s*\{[^}]*\}|\\usepackage\s*(?:\[[^\]]*\])?\s*\{biblatex\}|\\ExecuteBibliographyOptions\s*(?:\[[^\]]*\])?\s*\{[^}]*\}')
+
+# Generated bibliographies (.bbl files), stored in cache/bibliographies and keyed on the bib files,
+# the cited keys in order of their first citation and the bibliography settings. Snapshots with the same
+# key reuse the .bbl of an earlier snapshot, so that latexmk neither runs bibtex / biber nor the extra pass after it.
+class BibliographyCache:
+    def __init__(self, project: Project):
+        self.cacheDir = f'{project.projectFolder}/cache/bibliographies'
+        self.latexCmd = project.config['latexCmd']
+        # replacements are applied to the bib files as well
+        self.text_replacements = project.config.get('text_replacements', [])
+
+    def getKey(self, snapshot: Snapshot, blobs: Dict[str, str]) -> Optional[str]:
+        bibFiles = sorted(os.path.normpath(file) for file in snapshot.includes if file.endswith('.bib'))
+        if len(bibFiles) == 0:
+            return None
+
+        citations: List[str] = []
+        known = set()
+        settings: List[str] = []
+        for file in snapshot.includes:
+            if not file.endswith('.tex') or not os.path.exists(f'{snapshot.getWorkDir()}/{file}'):
+                continue
+
+            with open(f'{snapshot.getWorkDir()}/{file}', 'r', encoding='utf-8', errors='replace') as f:
+                content = COMMENT_PATTERN.sub('', f.read())
+
+            settings.extend(match.group(0) for match in BIB_SETTINGS_PATTERN.finditer(content))
+            for keys in CITE_PATTERN.findall(content):
+                for key in keys.split(','):
+                    key = key.strip()
+                    if key != '' and key not in known:
+                        known.add(key)
+                        citations.append(key)
+
+        # local bibliography styles change the output as well
+        files = bibFiles + sorted(file for file in blobs if file.endswith(SUPPORT_FILE_EXTENSIONS))
+        replacements = json.dumps(self.text_replacements, sort_keys=True)
+        payload = '\0'.join([self.latexCmd, replacements, ','.join(citations)] + settings + [f'{file}:{blobs.get(file, "")}' for file in files])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def getBblPath(self, snapshot: Snapshot) -> str:
+        return f'{snapshot.getWorkDir()}/{snapshot.main_tex_file[:-4]}.bbl'
+
+    def restore(self, snapshot: Snapshot, key: str) -> bool:
+        cachedFile = f'{self.cacheDir}/{key}.bbl'
+        if not os.path.exists(cachedFile):
+            return False
+
+        shutil.copyfile(cachedFile, self.getBblPath(snapshot))
+        return True
+
+    def store(self, snapshot: Snapshot, key: str) -> None:
+        if not os.path.exists(self.getBblPath(snapshot)):
+            return
+
+        # copy to a temporary file first so that concurrent readers never see partial files
+        os.makedirs(self.cacheDir, exist_ok=True)
+        tmpFile = f'{self.cacheDir}/{key}.bbl.tmp-{uuid.uuid4().hex}'
+        shutil.copyfile(self.getBblPath(snapshot), tmpFile)
+        os.replace(tmpFile, f'{self.cacheDir}/{key}.bbl')
@@ -0,0 +1,60 @@
+import os
+import signal
+import subprocess
+import threading
+from typing import Optional, Set
+
+class CancelledError(Exception):
+    pass
+
+# Shared by all threads of a run. Cancelling stops the run from starting new work and
+# terminates all external commands (e.g. latexmk and its children) that are still running.
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.processes: Set[subprocess.Popen] = set()
+
+    def cancel(self) -> None:
+        self.event.set()
+        with self.lock:
+            processes = list(self.processes)
+
+        for process in processes:
+            killProcessGroup(process)
+
+    def isCancelled(self) -> bool:
+        return self.event.is_set()
+
+    def raiseIfCancelled(self) -> None:
+        if self.isCancelled():
+            raise CancelledError('Run was cancelled')
+
+    def register(self, process: subprocess.Popen) -> None:
+        with self.lock:
+            self.processes.add(process)
+
+        # cancelled while the process was starting
+        if self.isCancelled():
+            killProcessGroup(process)
+
+    def unregister(self, process: subprocess.Popen) -> None:
+        with self.lock:
+            self.processes.discard(process)
+
+
+def killProcessGroup(process: subprocess.Popen) -> None:
+    # commands are started in their own session, so that their child processes are stopped as well
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+# token of the run the current thread works for
+currentToken = threading.local()
+
+def setCurrentToken(token: Optional[CancelToken]) -> None:
+    currentToken.token = token
+
+def getCurrentToken() -> Optional[CancelToken]:
+    return getattr(currentToken, 'token', None)
@@ -1,33 +1,24 @@
 import os
+import queue
 import threading
-import concurrent.futures
-from typing import List
+import time
+from typing import Dict, List, Optional, Tuple
 from ffmpeg_progress_yield import FfmpegProgress
-from shutil import rmtree, copytree
 
 from tex_timelapse.project import Project
 from tex_timelapse.reporter import Reporter
 from tex_timelapse.snapshot import Snapshot, SnapshotStatus
 from tex_timelapse.actions.action import Action
+from tex_timelapse.git_diff import precomputeDiffs
+from tex_timelapse.frame_writer import FrameWriter
+from tex_timelapse.pipeline import Pipeline, getConfigFingerprint, getFingerprints, findStartAction, runAction
+from tex_timelapse.workdir import leaseWorkDir, releaseWorkDir
+from tex_timelapse.cancellation import CancelToken
 
-executor = concurrent.futures.ThreadPoolExecutor()
+# seconds between two utilisation reports of the pipeline stages
+UTILISATION_INTERVAL = 5
 
-def setThreads(threads: int) -> None:
-    global executor
-    executor = concurrent.futures.ThreadPoolExecutor(threads)
-
-def initFolder(project: Project, id: int) -> str:
-    workDir = f"{project.projectFolder}/workdir/{id}"
-
-    if not os.path.exists(workDir):
-        copytree(f'{project.projectFolder}/source/.git', f'{workDir}/.git', dirs_exist_ok=True)
-
-    return workDir
-
-def cleanupFolder(project: Project, folder: str) -> None:
-    rmtree(f"{folder}/latex", ignore_errors=True)
-
-def compileProject(project: Project, output: str, actions: List[Action], reporter: Reporter) -> None:
+def compileProject(project: Project, output: str, actions: List[Action], reporter: Reporter, cancelToken: Optional[CancelToken] = None) -> None:
     snapshot_count = len(project.snapshots)
     concat_commits = project.config.get('concatCommits', -1)
     if concat_commits > 0:
@@ -38,7 +29,19 @@ def compileProject(project: Project, output: str, actions: List[Action], reporte
     # skip commits if concat commits is enabled, but start with the first commit
     skip_count = concat_commits
 
+    framerate = project.config['framerate']
+    store = project.openSnapshotStore()
+    pipeline: Optional[Pipeline] = None
+    frame_writer = None
+
     try:
+        pipeline = Pipeline(project, actions, reporter, cancelToken)
+
+        # frames are either streamed into ffmpeg as soon as they are ready, or written to disk and rendered at the end
+        os.makedirs(f'{project.projectFolder}/output', exist_ok=True)
+        if project.config.get('streamFrames', False):
+            frame_writer = FrameWriter(framerate, getVideoOutputArgs(project, output))
+
         pending_snapshots = []
         for snapshot in project.snapshots:
             # skip # of commits if concat commits is enabled
@@ -48,95 +51,222 @@ def compileProject(project: Project, output: str, actions: List[Action], reporte
             pending_snapshots.append(snapshot)
             skip_count = 0
 
-        retry_count = 0
+        # diffs between consecutive commits can be read in a single pass over the history
+        checkout_snapshots = [s for s in pending_snapshots if findStartAction(s, actions, pipeline.fingerprints) == 0]
+        if concat_commits <= 1 and len(checkout_snapshots) > 0:
+            diffs = precomputeDiffs(f'{project.projectFolder}/source', [s.commit_sha for s in checkout_snapshots])
+            for snapshot in checkout_snapshots:
+                snapshot.parent_diffs = diffs.get(snapshot.commit_sha)
+
+        # position of each snapshot in the final video; retries take over the position of the failed snapshot
+        slots = { snapshot.commit_sha: slot for slot, snapshot in enumerate(pending_snapshots) }
+        positions = { snapshot.commit_sha: i for i, snapshot in enumerate(project.snapshots) }
 
-        while len(pending_snapshots) > 0 and (retry_count < concat_commits // 2 or concat_commits == -1):
-            futures = []
-            for snapshot in pending_snapshots:
-                future = executor.submit(compileSnapshot, project, snapshot, actions, reporter)
-                futures.append(future)
+        # bisection for the nearest compilable commit before failed snapshots, by slot
+        searches: Dict[int, FallbackSearch] = {}
+        fingerprint = getConfigFingerprint(project, actions)
+        brokenRanges = [(positions[first], positions[last]) for first, last in store.getBrokenRanges(fingerprint) if first in positions and last in positions]
 
-            retry_count += 1
-            pending_snapshots = []
+        # snapshots are fed from a separate thread, as submitting blocks while the first stage is full.
+        # The bounded stage queues limit the number of snapshots in flight, follow-up work is queued right away
+        feederErrors: List[Exception] = []
+        def feed() -> None:
+            try:
+                pipeline.submitAll(pending_snapshots)
+            except Exception as e:
+                feederErrors.append(e)
 
-            # Await results from compilation
-            for future in concurrent.futures.as_completed(futures):
-                completed_snapshot = future.result()
-                
-                # retry compilation if we skipped commits from concatention anyway
-                if concat_commits > 0 and completed_snapshot.status == SnapshotStatus.FAILED:
-                    # progressively try previous snapshots if available - maybe we can find a working one
-                    snapshot_index = next((i for i, snapshot in enumerate(project.snapshots) if snapshot.commit_sha == completed_snapshot.commit_sha), -1)
-                    if snapshot_index > 0:
-                        previous_snapshot = project.snapshots[snapshot_index - 1]
-                        pending_snapshots.append(previous_snapshot)
-                        reporter.log(f'Retrying snapshot {completed_snapshot.commit_sha} ({retry_count}/{concat_commits // 2})')
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
 
-        Snapshot.serialize(f'{project.projectFolder}/snapshots.yaml', project.snapshots)
+        # snapshots submitted to the pipeline whose results are still outstanding
+        remaining = len(pending_snapshots)
+
+        # Await results from compilation
+        last_report = time.monotonic()
+        while remaining > 0:
+            # snapshots that were not submitted never arrive
+            if len(feederErrors) > 0:
+                raise feederErrors[0]
+
+            if time.monotonic() - last_report >= UTILISATION_INTERVAL:
+                reporter.set_utilisation(pipeline.getUtilisation())
+                last_report = time.monotonic()
+
+            try:
+                completed_snapshot = pipeline.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            remaining -= 1
+
+            # snapshots compiled in another process come back as new objects
+            position = positions[completed_snapshot.commit_sha]
+            project.snapshots[position] = completed_snapshot
+            completed_snapshot.parent_diffs = None
+            slot = slots[completed_snapshot.commit_sha]
+
+            # snapshots interrupted by a cancellation keep their stored state from earlier runs
+            if pipeline.isCancelled() and completed_snapshot.status != SnapshotStatus.COMPLETED:
+                continue
+
+            # store progress right away, so that it survives a crash
+            store.upsert(completed_snapshot)
+
+            search = searches.get(slot)
+            if search is not None:
+                replaced = search.update(position, completed_snapshot)
+                if replaced is not None:
+                    discardFrame(project, replaced)
+            elif completed_snapshot.status == SnapshotStatus.COMPLETED:
+                if frame_writer is not None:
+                    frame_writer.push(slot, completed_snapshot.frame)
+                    completed_snapshot.frame = None
+                continue
+            elif concat_commits > 0 and concat_commits // 2 > 0:
+                # commits skipped by the concatenation before the failed snapshot may still compile
+                search = FallbackSearch(position, max(0, position - concat_commits // 2), brokenRanges)
+                searches[slot] = search
+
+            if search is not None:
+                probe = search.nextProbe()
+                if probe is not None:
+                    slots[project.snapshots[probe].commit_sha] = slot
+                    pipeline.submitLater(project.snapshots[probe])
+                    remaining += 1
+                    reporter.log(f'Trying commit {project.snapshots[probe].commit_sha} for failed snapshot {project.snapshots[search.failed].commit_sha}')
+                    continue
+
+                # commits that were compiled and failed are skipped by later runs. Commits between them are only
+                # assumed to be broken by the bisection, they are not remembered so that they are tried again
+                del searches[slot]
+                for broken in search.failedProbes + [search.failed]:
+                    brokenRanges.append((broken, broken))
+                    store.addBrokenRange(project.snapshots[broken].commit_sha, project.snapshots[broken].commit_sha, fingerprint)
+
+                if search.best is not None:
+                    if frame_writer is not None:
+                        frame_writer.push(slot, search.best.frame)
+                        search.best.frame = None
+                    continue
+
+            if frame_writer is not None:
+                frame_writer.skip(slot)
+
+        feeder.join()
 
     except Exception as e:
-        print(f"Error: {e}")
+        # interrupted by the cancellation, handled below
+        if cancelToken is None or not cancelToken.isCancelled():
+            # frames are missing, the video of an incomplete run is not rendered
+            reporter.log(f'Run failed: {e}')
+            if frame_writer is not None:
+                frame_writer.abort()
+            raise
 
-    rmtree(f"{project.projectFolder}/workdir", ignore_errors=True)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        store.close()
+
+    if cancelToken is not None and cancelToken.isCancelled():
+        if frame_writer is not None:
+            frame_writer.abort()
+        reporter.log('Run was cancelled')
+        return
 
     # render video
+    if frame_writer is not None:
+        reporter.set_stage("Finishing video", 1)
+        frame_writer.close()
+        reporter.set_progress(1)
+        return
+
     reporter.set_stage("Rendering video", 100)
     os.makedirs(f'{project.projectFolder}/frames', exist_ok=True)
 
-    os.makedirs(f'{project.projectFolder}/output', exist_ok=True)
-    framerate = project.config['framerate']
-    cmd = f"""ffmpeg -y -framerate {framerate}
-        -pattern_type glob -i {project.projectFolder}/frames/*.png
-        -c:v libx264 -movflags +faststart
-        -vf format=yuv420p,scale=iw*0.25:ih*0.25,pad=ceil(iw/2)*2:ceil(ih/2)*2:0:0:white
-        -strict -2 {project.projectFolder}/output/{output}.mp4
-    """
-
-    ff = FfmpegProgress([ c.strip() for c in cmd.split(' ') if c != ''])
+    cmd = ['ffmpeg', '-y', '-framerate', str(framerate), '-pattern_type', 'glob', '-i', f'{project.projectFolder}/frames/*.png']
+    ff = FfmpegProgress(cmd + getVideoOutputArgs(project, output))
     for progress in ff.run_command_with_progress():
         reporter.set_progress(progress / 100)
 
+# Finds the nearest compilable commit before a failed snapshot by bisection, assuming that a document
+# breaks once within the window and stays broken until the failed snapshot. Needs O(log window) compile attempts.
+class FallbackSearch:
+    def __init__(self, failed: int, first: int, brokenRanges: List[Tuple[int, int]]):
+        self.failed = failed
+        # candidates are the positions in [lo, hi), all positions from hi to the failed snapshot are broken
+        self.lo = first
+        self.hi = failed
+        self.best: Optional[Snapshot] = None
+        self.brokenRanges = brokenRanges
+        # probed positions that failed to compile
+        self.failedProbes: List[int] = []
+
+    def update(self, position: int, snapshot: Snapshot) -> Optional[Snapshot]:
+        # returns the previous best snapshot if the new one is closer to the failed snapshot
+        if snapshot.status != SnapshotStatus.COMPLETED:
+            self.hi = min(self.hi, position)
+            self.failedProbes.append(position)
+            return None
+
+        replaced = self.best
+        self.best = snapshot
+        self.lo = position + 1
+        return replaced
+
+    def nextProbe(self) -> Optional[int]:
+        while self.lo < self.hi:
+            probe = (self.lo + self.hi) // 2
+            known = [first for first, last in self.brokenRanges if first <= probe <= last]
+            if len(known) == 0:
+                return probe
+
+            # known to be broken from earlier runs, no need to compile it again
+            self.hi = max(self.lo, min(known))
+
+        return None
+
+def discardFrame(project: Project, snapshot: Snapshot) -> None:
+    # frame of a fallback commit that was replaced by a closer one, see AssembleImageAction
+    snapshot.frame = None
+    framePath = f'{project.projectFolder}/frames/frame_{snapshot.index:09d}.png'
+    if os.path.exists(framePath):
+        os.remove(framePath)
+
+def getVideoOutputArgs(project: Project, output: str) -> List[str]:
+    return [
+        '-c:v', 'libx264', '-movflags', '+faststart',
+        '-vf', 'format=yuv420p,scale=iw*0.25:ih*0.25,pad=ceil(iw/2)*2:ceil(ih/2)*2:0:0:white',
+        '-strict', '-2', f'{project.projectFolder}/output/{output}.mp4'
+    ]
 
 
 def compileSnapshot(project: Project, snapshot: Snapshot, actions: List[Action], reporter: Reporter) -> Snapshot:
-    thread_id = threading.get_ident()
+    fingerprints = getFingerprints(project, actions)
+    start = findStartAction(snapshot, actions, fingerprints)
 
-    workDir = initFolder(project, thread_id)
+    # nothing changed since the last run
+    if start == len(actions):
+        snapshot.status = SnapshotStatus.COMPLETED
+        reporter.add_progress(snapshot)
+        return snapshot
+
+    workDir, lockFile = leaseWorkDir(project)
     snapshot.setWorkDir(workDir)
 
     snapshot.status = SnapshotStatus.IN_PROGRESS
+    snapshot.error = ''
     reporter.update_progress(snapshot)
 
-    for action in actions:
-        action.init(project)
-        snapshot.jobs[action.getName()] = SnapshotStatus.IN_PROGRESS
-        reporter.update_progress(snapshot)
-
-        try:
-            result = action.run(snapshot)
-            snapshot.jobs[action.getName()] = SnapshotStatus.COMPLETED
-        except Exception as e:
-            result = SnapshotStatus.FAILED
-            snapshot.error = str(e)
-            reporter.log(f'Action "{action.getName()}" for snapshot {snapshot.commit_sha} failed with error: {e}')
-        
-        if result == SnapshotStatus.FAILED:
-            snapshot.status = SnapshotStatus.FAILED
-            snapshot.jobs[action.getName()] = SnapshotStatus.FAILED
-            break
-
-        reporter.update_progress(snapshot)
-
-        action.cleanup()
-    
+    try:
+        for action, fingerprint in zip(actions[start:], fingerprints[start:]):
+            if not runAction(project, snapshot, action, fingerprint, reporter):
+                break
+    finally:
+        releaseWorkDir(lockFile)
+
     if snapshot.status != SnapshotStatus.FAILED:
         snapshot.status = SnapshotStatus.COMPLETED
-    # else:
-    #     # retry if concat commits is enabled
-    #     if project.config['concatCommits'] and snapshot.concat_commit_retry_count < project.config['concatCommitsMax'] // 2:
-    #         snapshot.concat_commit_retry_count += 1
-    #         reporter.log(f'Retrying snapshot {snapshot.commit_sha} ({snapshot.concat_commit_retry_count}/{project.config["concatCommitsMax"] // 2})')
-    #         return compileSnapshot(project, snapshot, actions, reporter)
 
     reporter.add_progress(snapshot)
     return snapshot
@@ -0,0 +1,106 @@
+import threading
+from typing import Dict, List, Set, Tuple
+import numpy as np
+from PIL import Image
+
+# highlight colors as (rgb, alpha)
+PAGE_HIGHLIGHT = ((0xA3, 0xBE, 0x8C), 0x44)
+CHANGE_HIGHLIGHT = ((0x81, 0xA1, 0xC1), 0x44)
+
+compositors = threading.local()
+
+def createBlendTable(color: Tuple[int, int, int], alpha: int) -> np.ndarray:
+    # result of blending each possible channel value with the color: value * (1 - alpha) + color * alpha
+    values = np.arange(256, dtype=np.uint32)
+    return np.stack([(values * (255 - alpha) + c * alpha + 127) // 255 for c in color]).astype(np.uint8)
+
+PAGE_BLEND_TABLE = createBlendTable(*PAGE_HIGHLIGHT)
+CHANGE_BLEND_TABLE = createBlendTable(*CHANGE_HIGHLIGHT)
+
+# Assembles frames in a single preallocated grid buffer. Pages are written into slices of the buffer,
+# highlights are blended in with lookup tables, only for highlighted pages.
+class FrameCompositor:
+    def __init__(self, rows: int, columns: int, tileSize: Tuple[int, int]):
+        self.rows = rows
+        self.columns = columns
+        self.tileWidth, self.tileHeight = tileSize
+
+        self.buffer = np.empty((rows * self.tileHeight, columns * self.tileWidth, 3), dtype=np.uint8)
+        self.highlightedPages: Set[int] = set()
+        # page -> highlighted boxes as (x1, y1, x2, y2), exclusive end coordinates
+        self.boxes: Dict[int, List[Tuple[int, int, int, int]]] = {}
+
+    @staticmethod
+    def get(rows: int, columns: int, tileSize: Tuple[int, int]) -> 'FrameCompositor':
+        # one compositor per worker thread, reused for all frames of the same layout
+        compositor = getattr(compositors, 'compositor', None)
+        if compositor is None or (compositor.rows, compositor.columns, compositor.tileWidth, compositor.tileHeight) != (rows, columns) + tuple(tileSize):
+            compositor = compositors.compositor = FrameCompositor(rows, columns, tileSize)
+        return compositor
+
+    def clear(self) -> None:
+        self.buffer.fill(255)
+        self.highlightedPages.clear()
+        self.boxes.clear()
+
+    def getTile(self, index: int) -> np.ndarray:
+        top = (index // self.columns) * self.tileHeight
+        left = (index % self.columns) * self.tileWidth
+        return self.buffer[top:top + self.tileHeight, left:left + self.tileWidth]
+
+    def paste(self, index: int, image: Image.Image) -> None:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        pixels = np.asarray(image)
+
+        # smaller pages are aligned to the top left, like in a grid of differently sized images
+        height = min(pixels.shape[0], self.tileHeight)
+        width = min(pixels.shape[1], self.tileWidth)
+        self.getTile(index)[:height, :width] = pixels[:height, :width]
+
+    def highlightPage(self, index: int) -> None:
+        self.highlightedPages.add(index)
+
+    def highlightBox(self, index: int, x1: int, y1: int, x2: int, y2: int) -> None:
+        # coordinates are inclusive, as with ImageDraw.rectangle
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2 + 1, self.tileWidth), min(y2 + 1, self.tileHeight)
+        if x1 >= x2 or y1 >= y2:
+            return
+
+        self.boxes.setdefault(index, []).append((x1, y1, x2, y2))
+
+    def blendHighlights(self) -> None:
+        # boxes are blended with the original page, not with the page highlight
+        for index in self.highlightedPages | set(self.boxes.keys()):
+            tile = self.getTile(index)
+            boxes = self.boxes.get(index, [])
+
+            if len(boxes) > 0:
+                # only the bounding box of all boxes needs to be kept and masked
+                left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+                right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+                original = tile[top:bottom, left:right].copy()
+                mask = np.zeros(original.shape[:2], dtype=bool)
+                for x1, y1, x2, y2 in boxes:
+                    mask[y1 - top:y2 - top, x1 - left:x2 - left] = True
+
+            if index in self.highlightedPages:
+                blend(tile, PAGE_BLEND_TABLE)
+
+            if len(boxes) > 0:
+                blend(original, CHANGE_BLEND_TABLE)
+                np.copyto(tile[top:bottom, left:right], original, where=mask[:, :, None])
+
+    def save(self, path: str) -> None:
+        Image.fromarray(self.buffer).save(path)
+
+    def toImage(self) -> Image.Image:
+        # copies the buffer, so that the image stays valid while the next frame is assembled
+        return Image.fromarray(self.buffer.copy())
+
+
+def blend(pixels: np.ndarray, table: np.ndarray) -> None:
+    # in place, one channel at a time
+    for channel in range(3):
+        np.take(table[channel], pixels[..., channel], out=pixels[..., channel], mode='clip')
@@ -7,9 +7,12 @@ class Config(TypedDict, total=False):
     columns: int
     blur: float
     highlightChanges: bool
+    pageCacheSize: int # in megabytes
 
     useMultithreading: bool
-    workers: int # TODO: -1 should set to cpu count
+    useMultiprocessing: bool
+    workers: int # -1 sets to cpu count
+    stageWorkers: dict[str, int] # action name -> workers, defaults to workers
 
     startCommit: str
     endCommit: str
@@ -31,6 +34,8 @@ class Config(TypedDict, total=False):
 
     # TODO: maybe change to latexMode: pdflatex | luaLaTeX | xelatex...?
     latexCmd: str
+    precompilePreamble: bool # reuse a precompiled format of the preamble, only for pdflatex
+    reuseBibliography: bool # reuse .bbl files of snapshots with the same bib files and citations, only for latexmk
 
     text_replacements: list[dict[str, str]]
 
@@ -39,3 +44,6 @@ class Config(TypedDict, total=False):
 
     # Video settings
     framerate: int
+    streamFrames: bool
+
+    progressInterval: float # seconds between progress updates sent to the web UI
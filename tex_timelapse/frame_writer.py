@@ -0,0 +1,102 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple, Union
+from PIL import Image
+
+# frames kept in memory by the reorder buffer, further frames that arrive early are written to temporary files
+MAX_BUFFERED_FRAMES = 16
+
+# Writes assembled frames as raw rgb into an ffmpeg pipe. Frames may arrive in any order, so they are
+# held back in a reorder buffer until all frames before them have been written (or skipped).
+class FrameWriter:
+    def __init__(self, framerate: int, outputArgs: List[str]):
+        self.framerate = framerate
+        self.outputArgs = outputArgs
+        self.process: Optional[subprocess.Popen] = None
+        self.size: Optional[Tuple[int, int]] = None
+        self.nextSlot = 0
+        # slot -> frame, path of a frame in spillDir, or None for skipped slots
+        self.pending: Dict[int, Union[Image.Image, str, None]] = {}
+        self.bufferedFrames = 0
+        self.spillDir: Optional[str] = None
+        self.log = tempfile.TemporaryFile()
+
+    def push(self, slot: int, frame: Optional[Image.Image]) -> None:
+        if frame is not None and slot != self.nextSlot and self.bufferedFrames >= MAX_BUFFERED_FRAMES:
+            self.pending[slot] = self.spill(slot, frame)
+        else:
+            self.pending[slot] = frame
+            if frame is not None:
+                self.bufferedFrames += 1
+
+        while self.nextSlot in self.pending:
+            self.writePending(self.pending.pop(self.nextSlot))
+            self.nextSlot += 1
+
+    def skip(self, slot: int) -> None:
+        self.push(slot, None)
+
+    def spill(self, slot: int, frame: Image.Image) -> str:
+        if self.spillDir is None:
+            self.spillDir = tempfile.mkdtemp(prefix='frames-')
+
+        # uncompressed, as the frame is read again soon
+        path = f'{self.spillDir}/{slot}.ppm'
+        frame.convert('RGB').save(path, 'PPM')
+        return path
+
+    def writePending(self, frame: Union[Image.Image, str, None]) -> None:
+        if isinstance(frame, str):
+            with Image.open(frame) as image:
+                self.write(image)
+            os.remove(frame)
+        elif frame is not None:
+            self.bufferedFrames -= 1
+            self.write(frame)
+
+    def write(self, frame: Image.Image) -> None:
+        if self.process is None or self.size is None:
+            # video size is determined by the first frame
+            self.size = frame.size
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{self.size[0]}x{self.size[1]}', '-framerate', str(self.framerate),
+                   '-i', '-'] + self.outputArgs
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+
+        if frame.size != self.size:
+            frame = frame.resize(self.size)
+
+        assert self.process.stdin is not None
+        self.process.stdin.write(frame.convert('RGB').tobytes())
+
+    def abort(self) -> None:
+        # stop without finishing the video
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        self.pending.clear()
+        self.bufferedFrames = 0
+        self.cleanup()
+
+    def close(self) -> None:
+        try:
+            # write remaining frames, even if some frames before them never arrived
+            for slot in sorted(self.pending.keys()):
+                self.writePending(self.pending.pop(slot))
+
+            if self.process is not None:
+                assert self.process.stdin is not None
+                self.process.stdin.close()
+                if self.process.wait() != 0:
+                    self.log.seek(0)
+                    raise Exception(f'ffmpeg failed with error: {self.log.read().decode("utf-8", errors="replace")}')
+        finally:
+            self.cleanup()
+
+    def cleanup(self) -> None:
+        if self.spillDir is not None:
+            shutil.rmtree(self.spillDir, ignore_errors=True)
+            self.spillDir = None
+        self.log.close()
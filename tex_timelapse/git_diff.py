@@ -0,0 +1,70 @@
+import os
+import subprocess
+from typing import Dict, List
+
+from tex_timelapse.snapshot import Snapshot
+
+def splitDiff(output: str) -> Dict[str, str]:
+    diffs: Dict[str, str] = {}
+    file = None
+    for line in output.splitlines(keepends=True):
+        if line.startswith('diff --git '):
+            # header: diff --git a/<file> b/<file> (prefixes are swapped for reversed diffs)
+            paths = line[len('diff --git '):].rstrip('\n')
+            file = paths[2:2 + (len(paths) - 5) // 2]
+            diffs[file] = ''
+        if file is not None:
+            diffs[file] += line
+    return diffs
+
+def precomputeDiffs(sourceFolder: str, commits: List[str]) -> Dict[str, Dict[str, str]]:
+    # commit sha -> file -> diff to its parent, read with a single streaming 'git log -p' over all requested commits.
+    # Diffs are reversed (-R), so that they match 'git diff HEAD HEAD~1' as used for single snapshots
+    cmd = ['git', '-c', 'core.quotePath=false', 'log', '--no-walk=unsorted', '--stdin', '-p', '-R', '--unified=0',
+           '--no-renames', '--diff-merges=first-parent', '--format=%x00%H %P']
+    process = subprocess.Popen(cmd, cwd=sourceFolder, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace')
+
+    assert process.stdin is not None and process.stdout is not None and process.stderr is not None
+    process.stdin.write('\n'.join(commits) + '\n')
+    process.stdin.close()
+
+    diffs: Dict[str, Dict[str, str]] = {}
+    def store(commit: str, hasParent: bool, lines: List[str]) -> None:
+        # root commits have no previous version to compare against
+        diffs[commit] = splitDiff(''.join(lines)) if hasParent else {}
+
+    commit = None
+    hasParent = False
+    lines: List[str] = []
+    for line in process.stdout:
+        if line.startswith('\0'):
+            if commit is not None:
+                store(commit, hasParent, lines)
+
+            shas = line[1:].split()
+            commit, hasParent, lines = shas[0], len(shas) > 1, []
+        else:
+            lines.append(line)
+
+    if commit is not None:
+        store(commit, hasParent, lines)
+
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise Exception(f"Command '{' '.join(cmd)}' failed with error: {stderr}")
+
+    return diffs
+
+def getDiffs(snapshot: Snapshot, files: List[str], history: int) -> Dict[str, str]:
+    # match diffs to the file names used in snapshot.includes
+    names = { os.path.normpath(file): file for file in files }
+
+    if history == 1 and snapshot.parent_diffs is not None:
+        diffs = snapshot.parent_diffs
+    else:
+        # one diff for all files at once
+        cmd = ['git', '-c', 'core.quotePath=false', 'diff', '--unified=0', '--no-renames', 'HEAD', f'HEAD~{history}', '--'] + list(names.keys())
+        output = subprocess.run(cmd, cwd=snapshot.getWorkDir(), capture_output=True, text=True, errors='replace')
+        diffs = splitDiff(output.stdout) if output.returncode == 0 else {}
+
+    return { names[file]: diff for file, diff in diffs.items() if file in names and diff != '' }
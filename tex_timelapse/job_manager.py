@@ -0,0 +1,157 @@
+import concurrent.futures
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+from slugify import slugify
+
+from tex_timelapse.cancellation import CancelToken, setCurrentToken
+
+class JobStatus(object):
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    COMPLETED = "Completed"
+    FAILED = "Failed"
+    CANCELLED = "Cancelled"
+
+# seconds that finished jobs can still be queried, e.g. by clients that missed the update
+FINISHED_JOB_RETENTION = 600
+
+class Job:
+    def __init__(self, project_name: str, kind: str, target: Callable[['Job'], Any]):
+        self.id = uuid.uuid4().hex
+        self.project_name = project_name
+        # names that differ only in case or special characters refer to the same project folder
+        self.project_key = slugify(project_name)
+        self.kind = kind
+        self.target = target
+        self.token = CancelToken()
+
+        self.status = JobStatus.QUEUED
+        self.error = ''
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'project': self.project_name,
+            'kind': self.kind,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+# Runs long running work (e.g. compiling a project) in the background. Jobs of the same project
+# run one after another, as they share the project's work dirs and snapshot database.
+class JobManager:
+    def __init__(self, onUpdate: Optional[Callable[[Job], None]] = None):
+        self.onUpdate = onUpdate
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        # per project, only while it has queued or running jobs
+        self.executors: Dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+        self.activeJobs: Dict[str, int] = {}
+
+    def submit(self, project_name: str, kind: str, target: Callable[[Job], Any]) -> Job:
+        job = self.submitJob(Job(project_name, kind, target), False)
+        assert job is not None
+        return job
+
+    def submitIfIdle(self, project_name: str, kind: str, target: Callable[[Job], Any]) -> Optional[Job]:
+        # None if the project already has queued or running jobs, which the job would have to wait for
+        return self.submitJob(Job(project_name, kind, target), True)
+
+    def submitJob(self, job: Job, onlyIfIdle: bool) -> Optional[Job]:
+        with self.lock:
+            if onlyIfIdle and job.project_key in self.activeJobs:
+                return None
+
+            self.prune()
+            self.jobs[job.id] = job
+            if job.project_key not in self.executors:
+                self.executors[job.project_key] = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f'job-{job.project_key}')
+            self.activeJobs[job.project_key] = self.activeJobs.get(job.project_key, 0) + 1
+            executor = self.executors[job.project_key]
+
+        self.update(job)
+        executor.submit(self.run, job)
+        return job
+
+    def run(self, job: Job) -> None:
+        try:
+            # cancelled while queued
+            if job.token.isCancelled():
+                self.finish(job, JobStatus.CANCELLED)
+                return
+
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            self.update(job)
+
+            setCurrentToken(job.token)
+            try:
+                job.result = job.target(job)
+                self.finish(job, JobStatus.CANCELLED if job.token.isCancelled() else JobStatus.COMPLETED)
+            except Exception as e:
+                job.error = str(e)
+                self.finish(job, JobStatus.CANCELLED if job.token.isCancelled() else JobStatus.FAILED)
+            finally:
+                setCurrentToken(None)
+        finally:
+            self.release(job)
+
+    def release(self, job: Job) -> None:
+        # the worker thread of a project is stopped once it has no more jobs
+        with self.lock:
+            self.activeJobs[job.project_key] -= 1
+            if self.activeJobs[job.project_key] > 0:
+                return
+            del self.activeJobs[job.project_key]
+            executor = self.executors.pop(job.project_key)
+
+        # called from the worker thread itself, which ends after this job
+        executor.shutdown(wait=False)
+
+    def prune(self) -> None:
+        # must be called with the lock held
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > FINISHED_JOB_RETENTION:
+                del self.jobs[job_id]
+
+    def finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.done.set()
+        self.update(job)
+
+    def update(self, job: Job) -> None:
+        if self.onUpdate is not None:
+            self.onUpdate(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            self.prune()
+            return self.jobs.get(job_id)
+
+    def list(self, project_name: Optional[str] = None) -> List[Job]:
+        with self.lock:
+            self.prune()
+            jobs = list(self.jobs.values())
+        project_key = slugify(project_name) if project_name is not None else None
+        return [job for job in jobs if project_key is None or job.project_key == project_key]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None and not job.done.is_set():
+            job.token.cancel()
+        return job
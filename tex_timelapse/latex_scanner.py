@@ -0,0 +1,85 @@
+import fnmatch
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+# \command[options]{argument}, possibly spread over multiple lines
+COMMAND_PATTERN = re.compile(r'\\(include|input|addbibresource|bibliography|includegraphics)\*?\s*(?:\[[^\]]*\]\s*)*\{([^}]*)\}')
+COMMENT_PATTERN = re.compile(r'(?<!\\)%.*')
+BEGIN_DOCUMENT_PATTERN = re.compile(r'\\begin\s*\{document\}')
+
+# number of scanned files that are kept, the least recently used ones are removed first
+SCANNED_FILES_LIMIT = 10000
+
+# git blob sha -> (contains \begin{document}, referenced files), shared by all snapshots and runs of the process
+scannedFiles: 'OrderedDict[str, Tuple[bool, List[Tuple[str, str]]]]' = OrderedDict()
+scannedFilesLock = threading.Lock()
+
+def scanFile(workDir: str, file: str, blob: str) -> Tuple[bool, List[Tuple[str, str]]]:
+    with scannedFilesLock:
+        if blob in scannedFiles:
+            scannedFiles.move_to_end(blob)
+            return scannedFiles[blob]
+
+    with open(f'{workDir}/{file}', 'r', encoding='utf-8', errors='replace') as f:
+        content = COMMENT_PATTERN.sub('', f.read())
+
+    references = [(match.group(1), match.group(2).strip()) for match in COMMAND_PATTERN.finditer(content)]
+    result = (BEGIN_DOCUMENT_PATTERN.search(content) is not None, references)
+
+    with scannedFilesLock:
+        scannedFiles[blob] = result
+        if len(scannedFiles) > SCANNED_FILES_LIMIT:
+            scannedFiles.popitem(last=False)
+
+    return result
+
+def findMainTexFile(workDir: str, blobs: Dict[str, str]) -> str:
+    # prefer files closer to the repository root
+    texFiles = sorted((file for file in blobs if file.endswith('.tex')), key=lambda file: (file.count('/'), file))
+    for file in texFiles:
+        isMainFile, _ = scanFile(workDir, file, blobs[file])
+        if isMainFile:
+            return f'./{file}'
+
+    raise Exception("Could not find main .tex file")
+
+def findIncludedFiles(workDir: str, blobs: Dict[str, str], mainTexFile: str) -> List[str]:
+    included_files = [ mainTexFile ]
+    known_files = { os.path.normpath(mainTexFile) }
+    unscanned_files = [ os.path.normpath(mainTexFile) ]
+
+    while len(unscanned_files) > 0:
+        file = unscanned_files.pop(0)
+        if file not in blobs:
+            continue
+
+        _, references = scanFile(workDir, file, blobs[file])
+
+        new_files = []
+        for command, argument in references:
+            if command in ['include', 'input']:
+                new_files.append(argument if argument.endswith('.tex') else f'{argument}.tex')
+            elif command in ['addbibresource', 'bibliography']:
+                for bibFile in argument.split(','):
+                    bibFile = bibFile.strip()
+                    new_files.append(bibFile if bibFile.endswith('.bib') else f'{bibFile}.bib')
+            elif command == 'includegraphics':
+                # for images, we might need to add the extension
+                if argument.find('.') != -1:
+                    new_files.append(argument)
+                else:
+                    new_files.extend(f for f in blobs if fnmatch.fnmatchcase(f'./{f}', f'*{argument}.*'))
+
+        for new_file in new_files:
+            new_file = os.path.normpath(new_file)
+            if new_file not in known_files:
+                known_files.add(new_file)
+                included_files.append(new_file)
+
+                if new_file.endswith('.tex'):
+                    unscanned_files.append(new_file)
+
+    return included_files
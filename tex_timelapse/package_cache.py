@@ -0,0 +1,80 @@
+import fcntl
+import json
+import os
+import re
+import threading
+from typing import Dict, Set
+
+from tex_timelapse.latex_scanner import BEGIN_DOCUMENT_PATTERN, COMMENT_PATTERN
+from tex_timelapse.project import Project
+
+# \usepackage[options]{name1,name2}, \RequirePackage{name} and \documentclass[options]{name}
+PACKAGE_PATTERN = re.compile(r'\\(usepackage|RequirePackage|documentclass)\s*(?:\[[^\]]*\]\s*)?\{([^}]*)\}')
+# e.g. "! LaTeX Error: File `foo.sty' not found.", missing images or other document files are not installable
+MISSING_FILE_PATTERN = re.compile(r"! LaTeX Error: File `[^']+\.(sty|cls|def|cfg|fd|clo|tex)' not found")
+
+# cache file -> resolved names, shared by all workers of the process
+resolvedPackages: Dict[str, Set[str]] = {}
+resolvedPackagesLock = threading.Lock()
+
+# Packages and document classes that texliveonfly already resolved for the project, stored in cache/packages.json.
+# texliveonfly runs the document through latex once, so it is only used when the preamble of a snapshot
+# uses something new, or when a compile failed because of a missing file.
+class PackageCache:
+    def __init__(self, project: Project):
+        self.cacheFile = f'{project.projectFolder}/cache/packages.json'
+
+    @staticmethod
+    def getPackages(texFile: str) -> Set[str]:
+        with open(texFile, 'r', encoding='utf-8', errors='replace') as f:
+            content = COMMENT_PATTERN.sub('', f.read())
+
+        # packages can only be loaded in the preamble
+        match = BEGIN_DOCUMENT_PATTERN.search(content)
+        if match is not None:
+            content = content[:match.start()]
+
+        packages: Set[str] = set()
+        for command, names in PACKAGE_PATTERN.findall(content):
+            prefix = 'class:' if command == 'documentclass' else ''
+            packages.update(f'{prefix}{name.strip()}' for name in names.split(',') if name.strip() != '')
+        return packages
+
+    @staticmethod
+    def isMissingFileError(output: str) -> bool:
+        return MISSING_FILE_PATTERN.search(output) is not None
+
+    def getResolved(self) -> Set[str]:
+        with resolvedPackagesLock:
+            if self.cacheFile not in resolvedPackages:
+                resolvedPackages[self.cacheFile] = self.read()
+            return set(resolvedPackages[self.cacheFile])
+
+    def getUnresolved(self, packages: Set[str]) -> Set[str]:
+        unresolved = packages - self.getResolved()
+        if len(unresolved) == 0:
+            return unresolved
+
+        # other processes may have resolved them in the meantime
+        with resolvedPackagesLock:
+            resolvedPackages[self.cacheFile] = self.read()
+        return packages - self.getResolved()
+
+    def markResolved(self, packages: Set[str]) -> None:
+        os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+        with resolvedPackagesLock, open(f'{self.cacheFile}.lock', 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            resolved = self.read() | packages
+
+            tmpFile = f'{self.cacheFile}.tmp-{os.getpid()}-{threading.get_ident()}'
+            with open(tmpFile, 'w') as f:
+                json.dump(sorted(resolved), f)
+            os.replace(tmpFile, self.cacheFile)
+            resolvedPackages[self.cacheFile] = resolved
+
+    def read(self) -> Set[str]:
+        try:
+            with open(self.cacheFile, 'r') as f:
+                return set(json.load(f))
+        except FileNotFoundError:
+            return set()
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, IndirectObject
+
+from tex_timelapse.project import Project
+
+# entries touched more recently than this are never evicted, as they might still be read by another worker
+EVICTION_GRACE_PERIOD = 60
+
+evictionLock = threading.Lock()
+# bytes stored since the size of the cache was last checked, per process
+storedBytes = 0
+
+# Project wide cache for single pages, keyed on the content of the pdf page instead of the whole document.
+# Consecutive snapshots mostly share the same pages, so they are only rasterized and blurred once.
+# The cache is limited to pageCacheSize megabytes, least recently used entries are removed first.
+class PageCache:
+    def __init__(self, project: Project):
+        self.cacheDir = f'{project.projectFolder}/cache/pages'
+        self.budget = int(project.config.get('pageCacheSize', 1024)) * 1024 * 1024
+
+    @staticmethod
+    def getPageHashes(reader: PdfReader, count: int) -> List[str]:
+        # hashes of the content streams and resources of the first count pages
+        digests: Dict[Tuple[int, int], bytes] = {}
+
+        hashes = []
+        for page in reader.pages[:count]:
+            h = hashlib.sha256()
+            for name in ['/MediaBox', '/Rotate', '/Annots']:
+                h.update(hashObject(page.get(name), digests))
+            h.update(hashObject(page.get_contents(), digests))
+            h.update(hashObject(getResources(page), digests))
+            hashes.append(h.hexdigest())
+
+        return hashes
+
+    @staticmethod
+    def getRasterKey(pageHash: str, size: Tuple[int, int]) -> str:
+        return hashlib.sha256(f'{pageHash}:{size[0]}x{size[1]}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def getTileKey(rasterKey: str, size: Tuple[int, int], blur: float) -> str:
+        return hashlib.sha256(f'{rasterKey}:{size[0]}x{size[1]}:{blur}'.encode('utf-8')).hexdigest()
+
+    def getPath(self, key: str, suffix: str) -> str:
+        return f'{self.cacheDir}/{key[:2]}/{key}{suffix}'
+
+    def get(self, key: str, suffix: str) -> Optional[str]:
+        path = self.getPath(key, suffix)
+        try:
+            # modification time is used as access time, as file systems are often mounted with noatime
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def getEntry(self, key: str, suffixes: List[str]) -> Optional[List[str]]:
+        # files stored together under one key, e.g. a page and its thumbnail, are only used if all of them
+        # still exist, and are all touched so that they are evicted together
+        paths = [self.get(key, suffix) for suffix in suffixes]
+        if any(path is None for path in paths):
+            return None
+        return [path for path in paths if path is not None]
+
+    def store(self, source: str, key: str, suffix: str) -> str:
+        # copy to a temporary file first so that concurrent readers never see partial files
+        tmpFile = self.getTmpPath(key, suffix)
+        shutil.copyfile(source, tmpFile)
+        return self.add(tmpFile, key, suffix)
+
+    def storeImage(self, image: Image.Image, key: str, suffix: str) -> str:
+        tmpFile = self.getTmpPath(key, suffix)
+        image.save(tmpFile)
+        return self.add(tmpFile, key, suffix)
+
+    def getTmpPath(self, key: str, suffix: str) -> str:
+        path = self.getPath(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # keep the suffix, so that the image format can be derived from the file name
+        return f'{path}.tmp-{uuid.uuid4().hex}{suffix}'
+
+    def add(self, tmpFile: str, key: str, suffix: str) -> str:
+        global storedBytes
+
+        path = self.getPath(key, suffix)
+        os.replace(tmpFile, path)
+
+        with evictionLock:
+            storedBytes += os.path.getsize(path)
+            # only look at the whole cache once a noticeable share of the budget was added
+            if storedBytes < self.budget // 20:
+                return path
+            storedBytes = 0
+            self.evict()
+
+        return path
+
+    def evict(self) -> None:
+        entries = []
+        for folder, _, files in os.walk(self.cacheDir):
+            for file in files:
+                try:
+                    stat = os.stat(f'{folder}/{file}')
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, f'{folder}/{file}'))
+
+        size = sum(entry[1] for entry in entries)
+        now = time.time()
+        for mtime, fileSize, path in sorted(entries):
+            if size <= self.budget or now - mtime < EVICTION_GRACE_PERIOD:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= fileSize
+
+
+def getResources(page: DictionaryObject) -> object:
+    # resources may be inherited from the page tree
+    node: Optional[DictionaryObject] = page
+    while node is not None:
+        if '/Resources' in node:
+            return node['/Resources']
+        parent = node.get('/Parent')
+        node = parent.get_object() if parent is not None else None
+    return None
+
+def hashObject(obj: object, digests: Dict[Tuple[int, int], bytes]) -> bytes:
+    # content based hash of a pdf object. Object numbers differ between compilations, so indirect
+    # objects are resolved and hashed by their content (and memoized, as fonts are shared by all pages)
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref not in digests:
+            # placeholder, in case of reference cycles
+            digests[ref] = b''
+            digests[ref] = hashObject(obj.get_object(), digests)
+        return digests[ref]
+
+    h = hashlib.sha256()
+    if isinstance(obj, (EncodedStreamObject, DecodedStreamObject)):
+        h.update(b'stream')
+        h.update(hashObject(DictionaryObject(obj), digests))
+        data = obj.get_data()
+        h.update(data.encode('utf-8') if isinstance(data, str) else data or b'')
+    elif isinstance(obj, DictionaryObject):
+        h.update(b'dict')
+        for key in sorted(obj.keys()):
+            # parent links only lead back to the page tree
+            if key == '/Parent':
+                continue
+            h.update(str(key).encode('utf-8'))
+            h.update(hashObject(obj.raw_get(key), digests))
+    elif isinstance(obj, (ArrayObject, list)):
+        h.update(b'array')
+        for item in obj:
+            h.update(hashObject(item, digests))
+    else:
+        h.update(repr(obj).encode('utf-8'))
+
+    return h.digest()
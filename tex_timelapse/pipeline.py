@@ -0,0 +1,386 @@
+import os
+import copy
+import math
+import json
+import time
+import queue
+import hashlib
+import threading
+import multiprocessing
+import concurrent.futures
+from collections import deque
+from typing import IO, Deque, Dict, List, Optional, Set, Tuple
+
+from tex_timelapse.config import Config
+from tex_timelapse.project import Project
+from tex_timelapse.reporter import Reporter
+from tex_timelapse.reporters.buffered_reporter import BufferedReporter
+from tex_timelapse.snapshot import Snapshot, SnapshotStatus
+from tex_timelapse.actions.action import Action
+from tex_timelapse.workdir import leaseWorkDir, releaseWorkDir
+from tex_timelapse.cancellation import CancelToken, setCurrentToken
+from tex_timelapse.frame_writer import MAX_BUFFERED_FRAMES
+
+def getWorkerCount(config: Config) -> int:
+    if not config.get('useMultithreading', True):
+        return 1
+
+    workers = int(config.get('workers', -1))
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def getStageWorkerCount(config: Config, action: Action) -> int:
+    stageWorkers = config.get('stageWorkers') or {}
+    if action.getName() in stageWorkers:
+        return max(1, int(stageWorkers[action.getName()]))
+    return getWorkerCount(config)
+
+def getFingerprints(project: Project, actions: List[Action]) -> List[str]:
+    # each fingerprint includes the previous one, so that changes propagate to all following actions
+    fingerprints = []
+    previous = ''
+    for action in actions:
+        config = { key: project.config.get(key) for key in action.getConfigKeys() }
+        data = json.dumps({ 'action': action.getName(), 'config': config, 'previous': previous }, sort_keys=True, default=str)
+        previous = hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+        # results that are not kept between runs are never up to date
+        fingerprints.append(previous if action.isResultPersisted(project) else '')
+
+    return fingerprints
+
+def getConfigFingerprint(project: Project, actions: List[Action]) -> str:
+    # config of all actions, unlike getFingerprints independent of whether their results are kept
+    config = { action.getName(): { key: project.config.get(key) for key in action.getConfigKeys() } for action in actions }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def findStartAction(snapshot: Snapshot, actions: List[Action], fingerprints: List[str]) -> int:
+    start = len(actions)
+    for i, action in enumerate(actions):
+        name = action.getName()
+        if snapshot.jobs.get(name) != SnapshotStatus.COMPLETED or fingerprints[i] == '' or snapshot.fingerprints.get(name) != fingerprints[i] or not action.isResultAvailable(snapshot):
+            start = i
+            break
+
+    # actions working on the checked out repository need the previous actions to prepare it again
+    while start < len(actions) and start > 0 and actions[start].requiresWorkDir():
+        start -= 1
+
+    return start
+
+def runAction(project: Project, snapshot: Snapshot, action: Action, fingerprint: str, reporter: Reporter) -> bool:
+    action.init(project)
+    snapshot.jobs[action.getName()] = SnapshotStatus.IN_PROGRESS
+    reporter.update_progress(snapshot)
+
+    try:
+        result = action.run(snapshot)
+        snapshot.jobs[action.getName()] = SnapshotStatus.COMPLETED
+        snapshot.fingerprints[action.getName()] = fingerprint
+    except Exception as e:
+        result = SnapshotStatus.FAILED
+        snapshot.error = str(e)
+        reporter.log(f'Action "{action.getName()}" for snapshot {snapshot.commit_sha} failed with error: {e}')
+
+    if result == SnapshotStatus.FAILED:
+        snapshot.status = SnapshotStatus.FAILED
+        snapshot.jobs[action.getName()] = SnapshotStatus.FAILED
+        snapshot.fingerprints.pop(action.getName(), None)
+        return False
+
+    reporter.update_progress(snapshot)
+
+    action.cleanup()
+    return True
+
+def runActionInProcess(project: Project, snapshot: Snapshot, action: Action, fingerprint: str) -> Tuple[Snapshot, bool, List[str]]:
+    reporter = BufferedReporter()
+    success = runAction(project, snapshot, action, fingerprint, reporter)
+    return snapshot, success, reporter.messages
+
+
+class PipelineItem:
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+        # lock of the work dir, held from the first until the last action that needs the work dir
+        self.lockFile: Optional[IO] = None
+        # lane of the snapshot while it is in the actions that need the work dir, see Pipeline.submitAll
+        self.lane: Optional[int] = None
+
+class PipelineStage:
+    def __init__(self, action: Action, fingerprint: str, workers: int):
+        self.action = action
+        self.fingerprint = fingerprint
+        self.workers = workers
+
+        # bounded, so that full stages hold back the previous stages
+        self.queue: queue.Queue = queue.Queue(workers)
+        self.threads: List[threading.Thread] = []
+        self.processPool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+        self.lock = threading.Lock()
+        self.busyTime = 0.0
+        self.activeSince: Dict[int, float] = {}
+        self.lastBusyTime = 0.0
+        self.lastSample = time.monotonic()
+
+    def begin(self) -> None:
+        with self.lock:
+            self.activeSince[threading.get_ident()] = time.monotonic()
+
+    def end(self) -> None:
+        with self.lock:
+            self.busyTime += time.monotonic() - self.activeSince.pop(threading.get_ident())
+
+    def getUtilisation(self) -> float:
+        # share of the stage's workers that were busy since the last call
+        with self.lock:
+            now = time.monotonic()
+            busyTime = self.busyTime + sum(now - since for since in self.activeSince.values())
+            elapsed = now - self.lastSample
+            utilisation = (busyTime - self.lastBusyTime) / (elapsed * self.workers) if elapsed > 0 else 0.0
+            self.lastBusyTime = busyTime
+            self.lastSample = now
+
+        return utilisation
+
+
+# Runs each action in its own pool of workers, with bounded queues between the actions.
+# Snapshots are passed from stage to stage, completed or failed snapshots end up in the results queue.
+class Pipeline:
+    def __init__(self, project: Project, actions: List[Action], reporter: Reporter, cancelToken: Optional[CancelToken] = None):
+        self.project = project
+        self.actions = actions
+        self.reporter = reporter
+        self.cancelToken = cancelToken
+        self.fingerprints = getFingerprints(project, actions)
+        self.results: queue.Queue = queue.Queue()
+
+        self.stages = [
+            PipelineStage(action, fingerprint, getStageWorkerCount(project.config, action))
+            for action, fingerprint in zip(actions, self.fingerprints)
+        ]
+
+        # the checked out work dir is needed by all actions up to the last action that requires it
+        self.lastWorkDirAction = max((i for i, action in enumerate(actions) if action.requiresWorkDir()), default=0)
+        self.workDirCount = max(stage.workers for stage in self.stages[:self.lastWorkDirAction + 1]) + 1
+        self.workDirs = threading.BoundedSemaphore(self.workDirCount)
+
+        self.lanesCondition = threading.Condition()
+        self.busyLanes: Set[int] = set()
+
+        # follow-up work (e.g. fallback commits of failed snapshots) is submitted by its own thread,
+        # so that whoever observes a failure never blocks on a full stage
+        self.followUps: queue.Queue = queue.Queue()
+        self.followUpThread = threading.Thread(target=self.submitFollowUps, daemon=True)
+        self.followUpThread.start()
+
+        useMultiprocessing = project.config.get('useMultiprocessing', False)
+        for index, stage in enumerate(self.stages):
+            if useMultiprocessing and stage.action.isCpuBound():
+                # forked workers would inherit the work dir locks that are held at that time
+                stage.processPool = concurrent.futures.ProcessPoolExecutor(stage.workers, mp_context=multiprocessing.get_context('forkserver'))
+
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self.work, args=(index,), daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+    def submit(self, snapshot: Snapshot, lane: Optional[int] = None) -> bool:
+        # returns whether the snapshot occupies the lane, i.e. whether it needs a work dir
+        # cancelled snapshots are passed through unchanged
+        if self.isCancelled():
+            self.results.put(snapshot)
+            return False
+
+        start = findStartAction(snapshot, self.actions, self.fingerprints)
+
+        # nothing changed since the last run
+        if start == len(self.actions):
+            self.finish(snapshot)
+            return False
+
+        snapshot.status = SnapshotStatus.IN_PROGRESS
+        snapshot.error = ''
+        self.reporter.update_progress(snapshot)
+
+        item = PipelineItem(snapshot)
+        if lane is not None and start <= self.lastWorkDirAction:
+            item.lane = lane
+            with self.lanesCondition:
+                self.busyLanes.add(lane)
+
+        # blocks while the stage is full
+        self.stages[start].queue.put(item)
+        return item.lane is not None
+
+    def submitAll(self, snapshots: List[Snapshot]) -> None:
+        # Each lane works through a contiguous range of commits, one snapshot at a time and in its own work dir.
+        # The latex aux files (.aux, .bbl, .fdb_latexmk, ...) of the previous commit are still there, so latexmk
+        # usually needs a single pass. Lanes that run out of commits take over half of the longest remaining range.
+        laneCount = min(self.workDirCount, len(snapshots))
+        if laneCount == 0:
+            return
+
+        if self.project.config.get('streamFrames', False):
+            # streamed frames are written in order, so the lanes take turns instead. Otherwise the frames of all
+            # but the first lane would wait in memory until the first lane reaches them. The aux files are then
+            # from a commit laneCount commits before, which is usually still close enough
+            lanes: List[Deque[Snapshot]] = [deque(snapshots[i::laneCount]) for i in range(laneCount)]
+        else:
+            size = math.ceil(len(snapshots) / laneCount)
+            lanes = [deque(snapshots[i * size:(i + 1) * size]) for i in range(laneCount)]
+
+        positions = { snapshot.commit_sha: i for i, snapshot in enumerate(snapshots) }
+        # position of the snapshot each lane is working on
+        working: Dict[int, int] = {}
+
+        def hasWork(lane: int) -> bool:
+            return len(lanes[lane]) > 0 or max(len(laneSnapshots) for laneSnapshots in lanes) > 1
+
+        def isDue(lane: int) -> bool:
+            # the frames of lanes that get too far ahead of the others would have to wait in the reorder buffer
+            if not self.project.config.get('streamFrames', False) or len(lanes[lane]) == 0:
+                return True
+            behind = [positions[laneSnapshots[0].commit_sha] for laneSnapshots in lanes if len(laneSnapshots) > 0]
+            behind += [working[busyLane] for busyLane in self.busyLanes if busyLane in working]
+            return positions[lanes[lane][0].commit_sha] - min(behind) < MAX_BUFFERED_FRAMES
+
+        def isReady(lane: int) -> bool:
+            return lane not in self.busyLanes and hasWork(lane) and isDue(lane)
+
+        while any(len(laneSnapshots) > 0 for laneSnapshots in lanes):
+            with self.lanesCondition:
+                self.lanesCondition.wait_for(lambda: any(isReady(lane) for lane in range(laneCount)))
+                readyLanes = [lane for lane in range(laneCount) if isReady(lane)]
+
+            for lane in readyLanes:
+                if len(lanes[lane]) == 0:
+                    self.stealRange(lanes, lane)
+
+                # snapshots that do not need a work dir are passed on without occupying the lane
+                while len(lanes[lane]) > 0:
+                    with self.lanesCondition:
+                        if not isDue(lane):
+                            break
+                    snapshot = lanes[lane].popleft()
+                    if self.submit(snapshot, lane):
+                        working[lane] = positions[snapshot.commit_sha]
+                        break
+
+    def submitLater(self, snapshot: Snapshot) -> None:
+        self.followUps.put(snapshot)
+
+    def submitFollowUps(self) -> None:
+        while True:
+            snapshot = self.followUps.get()
+            if snapshot is None:
+                break
+            self.submit(snapshot)
+
+    def stealRange(self, lanes: List[Deque[Snapshot]], lane: int) -> None:
+        victim = max(lanes, key=len)
+        count = len(victim) // 2
+        # taken from the end, so that both lanes keep working on contiguous commits
+        stolen = [victim.pop() for _ in range(count)]
+        lanes[lane].extend(reversed(stolen))
+
+    def releaseLane(self, item: PipelineItem) -> None:
+        with self.lanesCondition:
+            self.busyLanes.discard(item.lane)
+            self.lanesCondition.notify_all()
+        item.lane = None
+
+    def isCancelled(self) -> bool:
+        return self.cancelToken is not None and self.cancelToken.isCancelled()
+
+    def finish(self, snapshot: Snapshot) -> None:
+        if snapshot.status != SnapshotStatus.FAILED:
+            snapshot.status = SnapshotStatus.COMPLETED
+
+        self.reporter.add_progress(snapshot)
+        self.results.put(snapshot)
+
+    def work(self, index: int) -> None:
+        stage = self.stages[index]
+        # external commands started by this thread are stopped on cancellation
+        setCurrentToken(self.cancelToken)
+
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                break
+
+            stage.begin()
+            try:
+                success = self.runStage(index, item)
+            except Exception as e:
+                success = False
+                item.snapshot.status = SnapshotStatus.FAILED
+                item.snapshot.error = str(e)
+                self.reporter.log(f'Snapshot {item.snapshot.commit_sha} failed with error: {e}', item.snapshot)
+            finally:
+                stage.end()
+
+            if item.lockFile is not None and (index >= self.lastWorkDirAction or not success):
+                releaseWorkDir(item.lockFile)
+                item.lockFile = None
+                self.workDirs.release()
+
+            if item.lane is not None and (index >= self.lastWorkDirAction or not success):
+                self.releaseLane(item)
+
+            if success and index + 1 < len(self.stages):
+                self.stages[index + 1].queue.put(item)
+            else:
+                self.finish(item.snapshot)
+
+    def runStage(self, index: int, item: PipelineItem) -> bool:
+        stage = self.stages[index]
+        if self.cancelToken is not None:
+            self.cancelToken.raiseIfCancelled()
+
+        if index <= self.lastWorkDirAction and item.lockFile is None:
+            self.workDirs.acquire()
+            try:
+                # follow-up work has no lane, it gets a work dir of its own instead of taking over the one of a lane
+                workDir, item.lockFile = leaseWorkDir(self.project, item.lane if item.lane is not None else self.workDirCount)
+            except Exception:
+                self.workDirs.release()
+                raise
+            item.snapshot.setWorkDir(workDir)
+
+        if stage.processPool is None:
+            return runAction(self.project, item.snapshot, stage.action, stage.fingerprint, self.reporter)
+
+        # avoid sending the whole snapshot history to the worker process for each snapshot
+        workerProject = copy.copy(self.project)
+        workerProject.snapshots = []
+
+        future = stage.processPool.submit(runActionInProcess, workerProject, item.snapshot, stage.action, stage.fingerprint)
+        snapshot, success, messages = future.result()
+
+        for msg in messages:
+            self.reporter.log(msg, snapshot)
+
+        # the snapshot was changed in another process
+        item.snapshot = snapshot
+        self.reporter.update_progress(snapshot)
+        return success
+
+    def getUtilisation(self) -> Dict[str, float]:
+        return { stage.action.getName(): stage.getUtilisation() for stage in self.stages }
+
+    def close(self) -> None:
+        self.followUps.put(None)
+        self.followUpThread.join()
+
+        # stages are stopped in order, so that no stage receives new snapshots after it was stopped
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(None)
+            for thread in stage.threads:
+                thread.join()
+            if stage.processPool is not None:
+                stage.processPool.shutdown()
@@ -0,0 +1,110 @@
+import fcntl
+import hashlib
+import os
+import shlex
+import shutil
+import uuid
+from typing import Dict, Optional
+
+from tex_timelapse.latex_scanner import BEGIN_DOCUMENT_PATTERN, COMMAND_PATTERN, COMMENT_PATTERN
+from tex_timelapse.project import Project
+from tex_timelapse.snapshot import Snapshot
+from tex_timelapse.snapshot_cache import SUPPORT_FILE_EXTENSIONS
+
+# name of the format inside the work dir, found by pdflatex via -fmt as the work dir is the current directory
+FORMAT_NAME = 'tex-timelapse-preamble'
+
+# Precompiled formats of the document preamble (everything before \begin{document}), built with
+# mylatexformat. Loading packages is usually the largest part of the compile time and the preamble
+# rarely changes, so each distinct preamble is only compiled once and shared by all snapshots and workers.
+# Only pdflatex supports dumping formats reliably, other engines always compile normally.
+class PreambleFormatCache:
+    def __init__(self, project: Project):
+        self.formatDir = f'{project.projectFolder}/cache/formats'
+        self.latexCmd = project.config['latexCmd']
+
+    def getCompileCmd(self, texFile: str, latexmkOptions: str = '') -> Optional[str]:
+        # compile command that loads the format from the work dir, None if the engine is not supported
+        args = shlex.split(self.latexCmd)
+        if len(args) == 0:
+            return None
+
+        if args[0] == 'latexmk':
+            if any(arg in args for arg in ['-pdfxe', '-xelatex', '-pdflua', '-lualatex', '-pdfdvi', '-pdfps', '-dvi', '-ps']):
+                return None
+            return f'{self.latexCmd} {latexmkOptions} -pdflatex="pdflatex -fmt={FORMAT_NAME} %O %S" {texFile}'
+
+        if args[0] == 'pdflatex':
+            return f'pdflatex -fmt={FORMAT_NAME} {shlex.join(args[1:])} {texFile}'
+
+        return None
+
+    def getHash(self, snapshot: Snapshot, blobs: Dict[str, str]) -> Optional[str]:
+        with open(f'{snapshot.getWorkDir()}/{snapshot.main_tex_file}', 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+
+        match = BEGIN_DOCUMENT_PATTERN.search(content)
+        if match is None:
+            return None
+        preamble = content[:match.start()]
+
+        # local packages and files read by the preamble change the format as well
+        files = set(file for file in blobs if file.endswith(SUPPORT_FILE_EXTENSIONS))
+        for command, argument in COMMAND_PATTERN.findall(COMMENT_PATTERN.sub('', preamble)):
+            if command == 'input':
+                files.add(os.path.normpath(argument if argument.endswith('.tex') else f'{argument}.tex'))
+
+        payload = '\0'.join([self.latexCmd, preamble] + [f'{file}:{blobs.get(file, "")}' for file in sorted(files)])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def getFormatPath(self, preambleHash: str) -> str:
+        return f'{self.formatDir}/{preambleHash}.fmt'
+
+    def prepare(self, snapshot: Snapshot, blobs: Dict[str, str]) -> bool:
+        # makes the format of the snapshot's preamble available in its work dir, building it if necessary
+        preambleHash = self.getHash(snapshot, blobs)
+        if preambleHash is None:
+            return False
+
+        formatPath = self.getFormatPath(preambleHash)
+        failedPath = f'{self.formatDir}/{preambleHash}.failed'
+        os.makedirs(self.formatDir, exist_ok=True)
+
+        if not os.path.exists(formatPath) and not os.path.exists(failedPath):
+            # workers with the same preamble wait for the first one to build the format
+            with open(f'{self.formatDir}/{preambleHash}.lock', 'w') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                if not os.path.exists(formatPath) and not os.path.exists(failedPath):
+                    self.build(snapshot, formatPath, failedPath)
+
+        if not os.path.exists(formatPath):
+            return False
+
+        shutil.copyfile(formatPath, f'{snapshot.getWorkDir()}/{FORMAT_NAME}.fmt')
+        return True
+
+    def build(self, snapshot: Snapshot, formatPath: str, failedPath: str) -> None:
+        workDir = snapshot.getWorkDir()
+        jobName = f'{FORMAT_NAME}-{uuid.uuid4().hex}'
+
+        # dumps everything up to \begin{document}, when the format is loaded the preamble of the file is skipped
+        cmd = f'pdflatex -ini -interaction=nonstopmode -jobname={jobName} "&pdflatex" mylatexformat.ltx {snapshot.main_tex_file}'
+        try:
+            output = snapshot.execute_cmd(cmd, ignore_error=True, posix=True)
+        except OSError as e:
+            # pdflatex is not installed
+            output = str(e)
+
+        try:
+            if os.path.exists(f'{workDir}/{jobName}.fmt'):
+                tmpFile = f'{formatPath}.tmp-{uuid.uuid4().hex}'
+                shutil.copyfile(f'{workDir}/{jobName}.fmt', tmpFile)
+                os.replace(tmpFile, formatPath)
+            else:
+                # remembered, so that following snapshots with the same preamble do not try again
+                with open(failedPath, 'w') as f:
+                    f.write(output)
+        finally:
+            for extension in ['fmt', 'log']:
+                if os.path.exists(f'{workDir}/{jobName}.{extension}'):
+                    os.remove(f'{workDir}/{jobName}.{extension}')
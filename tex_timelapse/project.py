@@ -9,6 +9,7 @@ from slugify import slugify
 
 from tex_timelapse.config import Config
 from tex_timelapse.snapshot import Snapshot
+from tex_timelapse.snapshot_store import SnapshotStore
 import yaml
 
 @dataclass
@@ -22,33 +23,40 @@ class Project:
         self.projectFolder = f'./projects/{slugify(self.name)}'
         self.snapshots: List[Snapshot] = []
 
-    def loadSnapshots(self):
+    def loadSnapshots(self, includeChangedLines: bool = True):
         self.snapshots = []
 
-        # Load existing snapshots if file exists
-        if os.path.exists(f'{self.projectFolder}/snapshots.yaml'):
-            self.snapshots = Snapshot.deserialize(f'{self.projectFolder}/snapshots.yaml')
-            print(f"Loaded {len(self.snapshots)} existing snapshots for project {self.name}")
-
-        else:
-            # Check if there are any missing snapshots
-            repo = git.Repo(os.path.join(self.projectFolder, 'source'))
-            missingCounter = 0
-            indexCounter = len(self.snapshots)
-            for commit in reversed(list(repo.iter_commits())):
-                if commit.hexsha not in [snapshot.commit_sha for snapshot in self.snapshots]:
-                    missingCounter += 1
-                    sDict = Snapshot(commit.hexsha, commit.authored_date, indexCounter)
-                    indexCounter += 1
-                    self.snapshots.append(sDict)
-        
-            print(f"Added {missingCounter} missing snapshots")
-
-            if missingCounter > 0:
-                Snapshot.serialize(f'{self.projectFolder}/snapshots.yaml', self.snapshots)
+        store = self.openSnapshotStore()
+        try:
+            # Load existing snapshots if there are any
+            if store.count() > 0:
+                self.snapshots = store.load(includeChangedLines)
+                print(f"Loaded {len(self.snapshots)} existing snapshots for project {self.name}")
+
+            else:
+                # Check if there are any missing snapshots
+                repo = git.Repo(os.path.join(self.projectFolder, 'source'))
+                missingCounter = 0
+                indexCounter = len(self.snapshots)
+                for commit in reversed(list(repo.iter_commits())):
+                    if commit.hexsha not in [snapshot.commit_sha for snapshot in self.snapshots]:
+                        missingCounter += 1
+                        sDict = Snapshot(commit.hexsha, commit.authored_date, indexCounter)
+                        indexCounter += 1
+                        self.snapshots.append(sDict)
+
+                print(f"Added {missingCounter} missing snapshots")
+
+                if missingCounter > 0:
+                    store.upsertMany(self.snapshots)
+        finally:
+            store.close()
 
         self.snapshots.sort(key=lambda x: x.index)
 
+    def openSnapshotStore(self) -> SnapshotStore:
+        return SnapshotStore(self.projectFolder)
+
 
     def to_dict(self) -> dict[str, Any]:
         return {
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from slugify import slugify
+
+from tex_timelapse.project import Project
+from tex_timelapse.snapshot import Snapshot
+
+FileVersion = Tuple[Tuple[int, int], ...]
+
+class CachedProject:
+    def __init__(self, project: Project, version: FileVersion):
+        self.project = project
+        self.version = version
+        self.snapshots: Optional[List[Snapshot]] = None
+        self.snapshotDicts: Optional[List[Dict[str, Any]]] = None
+        self.snapshotsVersion: Optional[FileVersion] = None
+
+# Keeps deserialized projects and their snapshots (without changed lines) in memory for the web API. Entries
+# are reloaded when project.yaml or the snapshot database changed on disk, or when they are invalidated explicitly.
+# Cached objects are shared between requests and must not be modified.
+class ProjectCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: Dict[str, CachedProject] = {}
+
+    @staticmethod
+    def getVersion(files: List[str]) -> FileVersion:
+        # modification time and size of each file, (0, 0) for missing files
+        version = []
+        for file in files:
+            try:
+                stat = os.stat(file)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                version.append((0, 0))
+        return tuple(version)
+
+    def getEntry(self, name: str) -> CachedProject:
+        folder = f'./projects/{slugify(name)}'
+        # version is read before loading, so that concurrent changes lead to another reload instead of stale data
+        version = self.getVersion([f'{folder}/project.yaml'])
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry.version == version:
+                return entry
+
+        entry = CachedProject(Project.deserialize(name), version)
+        with self.lock:
+            self.entries[name] = entry
+        return entry
+
+    def getProject(self, name: str) -> Project:
+        return self.getEntry(name).project
+
+    def getSnapshotsVersion(self, entry: CachedProject) -> FileVersion:
+        folder = entry.project.projectFolder
+        # writes to the snapshot database first end up in its write ahead log
+        return self.getVersion([f'{folder}/snapshots.db', f'{folder}/snapshots.db-wal'])
+
+    def getSnapshotEntry(self, name: str) -> CachedProject:
+        entry = self.getEntry(name)
+        version = self.getSnapshotsVersion(entry)
+
+        with self.lock:
+            if entry.snapshots is not None and entry.snapshotsVersion == version:
+                return entry
+
+        # load into a separate project object, as the cached project is shared with other requests
+        project = Project.deserialize(name)
+        project.loadSnapshots(includeChangedLines=False)
+
+        with self.lock:
+            entry.snapshots = project.snapshots
+            entry.snapshotDicts = None
+            entry.snapshotsVersion = version
+        return entry
+
+    def getSnapshots(self, name: str) -> List[Snapshot]:
+        snapshots = self.getSnapshotEntry(name).snapshots
+        assert snapshots is not None
+        return snapshots
+
+    def getSnapshotDicts(self, name: str) -> List[Dict[str, Any]]:
+        entry = self.getSnapshotEntry(name)
+
+        with self.lock:
+            snapshots = entry.snapshots
+            snapshotDicts = entry.snapshotDicts
+        assert snapshots is not None
+        if snapshotDicts is not None:
+            return snapshotDicts
+
+        # changed lines are by far the largest part, they are only sent with single snapshots
+        snapshotDicts = [snapshot.to_dict(includeChangedLines=False) for snapshot in snapshots]
+        with self.lock:
+            # only keep the dicts if the snapshots were not reloaded in the meantime
+            if entry.snapshots is snapshots:
+                entry.snapshotDicts = snapshotDicts
+        return snapshotDicts
+
+    def getEtag(self, name: str, variant: str = '') -> str:
+        # changes whenever the project or its snapshots change on disk, without loading the snapshots
+        entry = self.getEntry(name)
+        data = f'{name}:{entry.version}:{self.getSnapshotsVersion(entry)}:{variant}'
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def invalidate(self, name: str) -> None:
+        with self.lock:
+            self.entries.pop(name, None)
+
+
+projectCache = ProjectCache()
@@ -1,6 +1,6 @@
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Dict, Optional
 
 from tex_timelapse.snapshot import Snapshot
 
@@ -21,6 +21,11 @@ class Reporter(ABC):
     def set_progress(self, num: float) -> None:
         pass
 
+    # share of busy workers per pipeline stage, between 0 and 1
+    @abstractmethod
+    def set_utilisation(self, utilisation: Dict[str, float]) -> None:
+        pass
+
     @abstractmethod
     def log(self, msg: str, snapshot: Optional[Snapshot] = None) -> None:
         pass
@@ -0,0 +1,27 @@
+from typing import Dict, List, Optional
+from tex_timelapse.reporter import Reporter
+from tex_timelapse.snapshot import Snapshot
+
+# Collects log messages in worker processes, where the actual reporter is not available.
+# The messages are passed back to the main process together with the compiled snapshot.
+class BufferedReporter(Reporter):
+    def __init__(self):
+        self.messages: List[str] = []
+
+    def set_stage(self, name: str, length: int) -> None:
+        pass
+
+    def add_progress(self, snapshot: Snapshot) -> None:
+        pass
+
+    def update_progress(self, snapshot: Snapshot) -> None:
+        pass
+
+    def set_progress(self, num: float) -> None:
+        pass
+
+    def set_utilisation(self, utilisation: Dict[str, float]) -> None:
+        pass
+
+    def log(self, msg: str, snapshot: Optional[Snapshot] = None) -> None:
+        self.messages.append(msg)
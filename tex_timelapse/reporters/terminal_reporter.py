@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 from alive_progress import alive_bar # type: ignore
 from tex_timelapse.reporter import Reporter
 from tex_timelapse.snapshot import Snapshot
@@ -27,6 +27,10 @@ class TerminalReporter(Reporter):
         self.bar(num)
         pass
 
+    def set_utilisation(self, utilisation: Dict[str, float]) -> None:
+        self.bar.text(', '.join(f'{name}: {value:.0%}' for name, value in utilisation.items()))
+        pass
+
     def log(self, msg: str, snapshot: Optional[Snapshot] = None) -> None:
         print(msg)
         pass
@@ -1,28 +1,85 @@
+import itertools
+import threading
 from flask_socketio import SocketIO # type: ignore
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from tex_timelapse.reporter import Reporter
 from tex_timelapse.snapshot import Snapshot
 
+# never change, clients already know them from the snapshot list
+FIXED_FIELDS = ('commit_sha', 'commit_date', 'index')
+
+# update versions keep increasing over all runs of the process, as clients keep the latest version they applied
+updateVersions = itertools.count(1)
+updateVersionsLock = threading.Lock()
+
+# Snapshot updates are collected and sent in batches, at most once per interval. Each update only
+# contains the fields that changed since the last update of the snapshot, together with a version
+# number, so that clients can apply them in order and skip outdated ones.
 class WebReporter(Reporter):
-    def __init__(self, socketio: SocketIO):
+    def __init__(self, socketio: SocketIO, interval: float = 0.5):
         self.socketio = socketio
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Dict[str, Any]] = {} # commit sha -> latest state, not sent yet
+        self.sent: Dict[str, Dict[str, Any]] = {} # commit sha -> state the clients know about
+        self.timer: Optional[threading.Timer] = None
 
     def set_stage(self, name: str, length: int) -> None:
+        self.flush()
         self.socketio.emit('stage', { 'stage': name, 'length': length })
 
     def add_progress(self, snapshot: Snapshot) -> None:
-        self.socketio.emit('add_progress', {
-            'snapshot': snapshot.to_dict()
-        })
+        self.queueUpdate(snapshot)
 
     def update_progress(self, snapshot: Snapshot) -> None:
-        self.socketio.emit('add_progress', {
-            'snapshot': snapshot.to_dict()
-        })
+        self.queueUpdate(snapshot)
+
+    def queueUpdate(self, snapshot: Snapshot) -> None:
+        # the state is taken right away, as the snapshot keeps changing in the worker threads
+        # changed lines are left out, they do not change during a run and are by far the largest part
+        state = snapshot.to_dict(includeChangedLines=False)
+        for field in FIXED_FIELDS:
+            del state[field]
+
+        with self.lock:
+            self.pending[snapshot.commit_sha] = state
+            if self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            pending = self.pending
+            self.pending = {}
+
+            updates: List[Dict[str, Any]] = []
+            for commit_sha, state in pending.items():
+                sent = self.sent.get(commit_sha, {})
+                update = { field: value for field, value in state.items() if sent.get(field) != value }
+                if len(update) == 0:
+                    continue
+
+                self.sent[commit_sha] = state
+                update['commit_sha'] = commit_sha
+                with updateVersionsLock:
+                    update['version'] = next(updateVersions)
+                updates.append(update)
+
+        if len(updates) > 0:
+            self.socketio.emit('snapshot_updates', { 'updates': updates })
 
     def set_progress(self, num: float) -> None:
+        self.flush()
         self.socketio.emit('set_progress', { 'set': num })
 
+    def set_utilisation(self, utilisation: Dict[str, float]) -> None:
+        self.socketio.emit('utilisation', utilisation)
+
     def log(self, msg: str, snapshot: Optional[Snapshot] = None) -> None:
         print(f"Log: {msg}")
         snapshot_sha = snapshot.commit_sha if snapshot is not None else None
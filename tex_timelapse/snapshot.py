@@ -1,33 +1,86 @@
-from dataclasses import dataclass
-from datetime import datetime
+import base64
+import hashlib
+import re
 import subprocess
-from typing import Any
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import yaml
 import shlex
 
+from tex_timelapse.cancellation import getCurrentToken
+
 class SnapshotStatus(object):
     PENDING = "Pending"
     IN_PROGRESS = "In Progress"
     COMPLETED = "Completed"
     FAILED = "Failed"
 
-@dataclass
+# highlight boxes are stored as flat float arrays with these fields per box
+BOX_FIELDS = ('page', 'x', 'y', 'h', 'v', 'W', 'H')
+# relative position of the highlights in the page images, for the web UI
+HIGHLIGHT_FIELDS = ('x1', 'y1', 'x2', 'y2')
+
+# git format example: @@ -33,5 55,4 @@ (number of removed / added lines may be optional)
+HUNK_PATTERN = re.compile(r'@@\s+-(\d+),?(\d*)\s+\+(\d+),?(\d*)\s+@@')
+
+def diffToLineRanges(diff: str) -> array:
+    # removed and added lines of all hunks as merged [start, end) ranges, stored flat as start1, end1, start2, ...
+    ranges = []
+    for match in HUNK_PATTERN.finditer(diff):
+        for start, count in [(match.group(1), match.group(2)), (match.group(3), match.group(4))]:
+            ranges.append((int(start), int(start) + int(count if count else 0) + 1))
+
+    merged = array('I')
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1]:
+            merged[-1] = max(merged[-1], end)
+        else:
+            merged.extend((start, end))
+    return merged
+
+def getPageName(index: int, count: int) -> str:
+    # file name of a page thumbnail, numbered the way pdftoppm does
+    return f'page-{index + 1:0{len(str(count))}d}.jpg'
+
+def packBoxes(boxes: List[Dict[str, float]]) -> array:
+    return array('f', (float(box[field]) for box in boxes for field in BOX_FIELDS))
+
+def unpackBoxes(packed: array, fields: Tuple[str, ...]) -> Iterator[Tuple[float, ...]]:
+    for i in range(0, len(packed), len(fields)):
+        yield tuple(packed[i:i + len(fields)])
+
+def encodeArray(values: array) -> str:
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def decodeArray(typecode: str, data: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    return values
+
 class Snapshot:
-    def __init__(self, commit_sha: str, commit_date: datetime, index: int):
+    __slots__ = ('commit_sha', 'commit_date', 'index', 'main_tex_file', 'cache_key', 'status', 'error', 'includes', 'pages',
+                 'changed_lines', 'changed_boxes', 'highlight_boxes', 'jobs', 'fingerprints', 'frame', 'parent_diffs', 'work_dir')
+
+    def __init__(self, commit_sha: str, commit_date: int, index: int):
         self.commit_sha = commit_sha
-        self.commit_date = commit_date
+        self.commit_date = int(commit_date)
         self.index = int(index)
         self.main_tex_file = '' # will be set by InitRepoAction
+        self.cache_key = '' # will be set by CompileLatexAction
 
         self.status: str = ''
         self.error = ''
-        self.includes: list[str] = []
-        #pdf_file: str
+        self.includes: List[str] = []
 
-        self.pages: list[str] = []
-        self.gitDiff: dict = {} # file -> changedLines
-        self.changed_pages: list[dict] = []
-        self.jobs: dict = {}
+        self.pages: List[str] = []
+        self.changed_lines: Dict[str, array] = {} # file -> changed line ranges, see diffToLineRanges
+        self.changed_boxes = array('f') # changed boxes in pdf coordinates, see BOX_FIELDS
+        self.highlight_boxes = array('f') # same boxes in image coordinates, see HIGHLIGHT_FIELDS
+        self.jobs: Dict[str, str] = {}
+        self.fingerprints: Dict[str, str] = {} # action -> fingerprint of the config the action last completed with
+        self.frame: Any = None # assembled frame, only kept in memory if frames are streamed into ffmpeg
+        self.parent_diffs: Optional[Dict[str, str]] = None # file -> diff to the parent commit, if precomputed for the run
+        self.work_dir = ''
 
     def setWorkDir(self, work_dir: str) -> None:
         self.work_dir = work_dir
@@ -35,53 +88,122 @@ class Snapshot:
     def getWorkDir(self) -> str:
         return self.work_dir
 
-    def execute_cmd(self, cmd: str, ignore_error = False, posix=False) -> str:
-        cwd = self.getWorkDir()
+    def execute_cmd(self, cmd: str, ignore_error = False, posix=False, cwd: Optional[str] = None) -> str:
+        if cwd is None:
+            cwd = self.getWorkDir()
 
-        output = subprocess.run(shlex.split(cmd, posix=posix), cwd=cwd, capture_output=True, text=True)
-        if output.returncode != 0 and not ignore_error:
-            self.error = output.stderr
-            raise Exception(f"Command '{cmd}' failed with error: {output.stderr}")
-        return output.stdout
+        # commands of cancellable runs get their own process group, so that they can be stopped with all their children
+        token = getCurrentToken()
+        if token is not None:
+            token.raiseIfCancelled()
 
+        process = subprocess.Popen(shlex.split(cmd, posix=posix), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, start_new_session=token is not None)
+        if token is not None:
+            token.register(process)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            if token is not None:
+                token.unregister(process)
 
-    def to_dict(self) -> dict[str, Any]:
-        return {
+        if token is not None:
+            token.raiseIfCancelled()
+
+        if process.returncode != 0 and not ignore_error:
+            self.error = stderr
+            raise Exception(f"Command '{cmd}' failed with error: {stderr}")
+        return stdout
+
+
+    def getThumbnailsVersion(self) -> str:
+        # page paths contain the page content and size, so they change whenever the thumbnails change
+        if len(self.pages) == 0:
+            return ''
+        return hashlib.sha1('\n'.join(self.pages).encode('utf-8')).hexdigest()[:16]
+
+    def to_dict(self, includeChangedLines: bool = True) -> Dict[str, Any]:
+        # format used by the web UI
+        changed_pages = []
+        highlights = list(unpackBoxes(self.highlight_boxes, HIGHLIGHT_FIELDS))
+        for i, box in enumerate(unpackBoxes(self.changed_boxes, BOX_FIELDS)):
+            # boxes are stored as 32 bit floats, rounding avoids printing their representation error
+            changed_page: Dict[str, Any] = { field: round(value, 5) for field, value in zip(BOX_FIELDS, box) }
+            changed_page['page'] = int(box[0])
+            if i < len(highlights):
+                changed_page.update((field, round(value, 5)) for field, value in zip(HIGHLIGHT_FIELDS, highlights[i]))
+            changed_pages.append(changed_page)
+
+        data = {
             'main_tex_file': self.main_tex_file,
+            'cache_key': self.cache_key,
             'commit_sha': self.commit_sha,
             'commit_date': self.commit_date,
             'index': self.index,
             'status': self.status,
             'error': self.error,
             'includes': list(self.includes),
-            'gitDiff': self.gitDiff,
+            # pages are stored in the page cache, the web UI only needs the names of their thumbnails
+            'pages': [getPageName(i, len(self.pages)) for i in range(len(self.pages))],
+            'thumbnails_version': self.getThumbnailsVersion(),
+            'jobs': dict(self.jobs),
+            'fingerprints': dict(self.fingerprints),
+            'changed_pages': changed_pages
+        }
+        if includeChangedLines:
+            data['changed_lines'] = { file: list(zip(ranges[::2], ranges[1::2])) for file, ranges in self.changed_lines.items() }
+        return data
+
+    def to_record(self) -> Dict[str, Any]:
+        # compact format for storage, see SnapshotStore
+        return {
+            'main_tex_file': self.main_tex_file,
+            'cache_key': self.cache_key,
+            'commit_sha': self.commit_sha,
+            'commit_date': self.commit_date,
+            'index': self.index,
+            'status': self.status,
+            'error': self.error,
+            'includes': self.includes,
+            'changed_lines': { file: list(ranges) for file, ranges in self.changed_lines.items() },
+            'changed_boxes': encodeArray(self.changed_boxes),
+            'highlight_boxes': encodeArray(self.highlight_boxes),
             'pages': self.pages,
             'jobs': self.jobs,
-            'changed_pages': list(self.changed_pages)
+            'fingerprints': self.fingerprints,
         }
 
     @staticmethod
-    def serialize(file_path: str, snapshot: list['Snapshot']) -> None:
-        with open(file_path, 'w') as file:
-            file.write(yaml.dump([snap.to_dict() for snap in snapshot]))
+    def from_record(record: Dict[str, Any]) -> 'Snapshot':
+        snapshot = Snapshot(record['commit_sha'], record['commit_date'], record['index'])
+        snapshot.main_tex_file = record.get('main_tex_file', '')
+        snapshot.cache_key = record.get('cache_key', '')
+        snapshot.status = record.get('status', '')
+        snapshot.error = record.get('error', '')
+        snapshot.includes = list(record.get('includes') or [])
+        snapshot.pages = list(record.get('pages') or [])
+        snapshot.jobs = dict(record.get('jobs') or {})
+        snapshot.fingerprints = dict(record.get('fingerprints') or {})
+
+        # snapshots of earlier versions store diff text and lists of dicts
+        for file, ranges in (record.get('changed_lines') or record.get('gitDiff') or {}).items():
+            snapshot.changed_lines[file] = diffToLineRanges(ranges) if isinstance(ranges, str) else array('I', (int(line) for line in ranges))
 
+        if 'changed_boxes' in record:
+            snapshot.changed_boxes = decodeArray('f', record['changed_boxes'])
+            snapshot.highlight_boxes = decodeArray('f', record.get('highlight_boxes', ''))
+        else:
+            changed_pages = record.get('changed_pages') or []
+            snapshot.changed_boxes = packBoxes(changed_pages)
+            if all(all(field in box for field in HIGHLIGHT_FIELDS) for box in changed_pages):
+                snapshot.highlight_boxes = array('f', (float(box[field]) for box in changed_pages for field in HIGHLIGHT_FIELDS))
+
+        return snapshot
+
+    # snapshots.yaml of earlier versions, only used for migrating to the snapshot store
     @staticmethod
-    def deserialize(file_path: str) -> list['Snapshot']:
+    def deserialize(file_path: str) -> List['Snapshot']:
         with open(file_path, 'r') as file:
             data = yaml.load(file, Loader=yaml.CBaseLoader)
-        
-        snapshots: list['Snapshot'] = []
-        for snap in data if data is not None else []:
-            snapshot = Snapshot(
-                commit_sha=snap["commit_sha"],
-                commit_date=snap["commit_date"],
-                index=int(snap["index"]),
-            )
-            snapshot.__dict__.update(snap)
-
-            # for some reason, index is stored as a string in the yaml file
-            snapshot.index = int(snapshot.index)
-
-            snapshots.append(snapshot)
-
-        return snapshots
+
+        return [Snapshot.from_record(snap) for snap in data] if data is not None else []
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, List, Optional
+
+from tex_timelapse.project import Project
+from tex_timelapse.snapshot import Snapshot
+
+# local class/style files are not part of snapshot.includes, but still change the output
+SUPPORT_FILE_EXTENSIONS = ('.cls', '.sty', '.bst', '.bbx', '.cbx')
+
+# Content-addressed cache for compilation results (pdf, synctex and the page cache keys of the rasterized pages).
+# Entries are keyed on the git blob hashes of all files of the document plus the relevant config,
+# so that identical document states are only compiled once.
+class SnapshotCache:
+    def __init__(self, project: Project):
+        self.cacheDir = f'{project.projectFolder}/cache'
+        self.latexCmd = project.config['latexCmd']
+        self.text_replacements = project.config.get('text_replacements', [])
+        # pages are rasterized for a specific frame layout
+        self.rasterName = f"raster-{project.config.get('rows')}x{project.config.get('columns')}"
+
+    def getKey(self, snapshot: Snapshot, blobs: Optional[Dict[str, str]] = None) -> str:
+        if blobs is None:
+            blobs = self.getBlobHashes(snapshot)
+
+        files = set(os.path.normpath(file) for file in snapshot.includes)
+        files.update(file for file in blobs if file.endswith(SUPPORT_FILE_EXTENSIONS))
+
+        payload = {
+            'main_tex_file': os.path.normpath(snapshot.main_tex_file),
+            'files': { file: blobs.get(file, '') for file in sorted(files) },
+            'latexCmd': self.latexCmd,
+            'text_replacements': self.text_replacements,
+        }
+
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def getBlobHashes(snapshot: Snapshot) -> Dict[str, str]:
+        # format: <mode> SP <type> SP <object> TAB <file>, separated by NUL
+        output = snapshot.execute_cmd('git ls-tree -r -z HEAD')
+
+        blobs: Dict[str, str] = {}
+        for entry in output.split('\0'):
+            if entry == '':
+                continue
+            meta, file = entry.split('\t', 1)
+            blobs[os.path.normpath(file)] = meta.split()[2]
+
+        return blobs
+
+    def getFolder(self, key: str) -> str:
+        return f'{self.cacheDir}/{key}'
+
+    def getPdfPath(self, key: str) -> str:
+        return f'{self.getFolder(key)}/document.pdf'
+
+    def getSynctexPath(self, key: str) -> str:
+        return f'{self.getFolder(key)}/document.synctex.gz'
+
+    def hasPdf(self, key: str) -> bool:
+        return os.path.exists(self.getPdfPath(key))
+
+
+    def storePdf(self, snapshot: Snapshot) -> None:
+        workDir = snapshot.getWorkDir()
+        basename = snapshot.main_tex_file[:-4]
+        folder = self.getFolder(snapshot.cache_key)
+        os.makedirs(folder, exist_ok=True)
+
+        synctexFile = f'{workDir}/{basename}.synctex.gz'
+        if os.path.exists(synctexFile):
+            with open(f'{folder}/workdir.txt', 'w') as f:
+                f.write(os.path.abspath(workDir))
+            self.storeFile(synctexFile, self.getSynctexPath(snapshot.cache_key))
+
+        # store pdf last, as its existence marks the entry as complete
+        self.storeFile(f'{workDir}/{basename}.pdf', self.getPdfPath(snapshot.cache_key))
+
+    def restorePdf(self, snapshot: Snapshot) -> None:
+        workDir = snapshot.getWorkDir()
+        basename = snapshot.main_tex_file[:-4]
+        folder = self.getFolder(snapshot.cache_key)
+
+        shutil.copyfile(self.getPdfPath(snapshot.cache_key), f'{workDir}/{basename}.pdf')
+
+        if not os.path.exists(self.getSynctexPath(snapshot.cache_key)):
+            return
+
+        # synctex stores absolute paths of the input files, which need to point to the current work dir
+        with open(f'{folder}/workdir.txt', 'r') as f:
+            cachedWorkDir = f.read().strip()
+
+        with gzip.open(self.getSynctexPath(snapshot.cache_key), 'rb') as f:
+            content = f.read()
+
+        currentWorkDir = os.path.abspath(workDir)
+        if cachedWorkDir != currentWorkDir:
+            content = content.replace(f'{cachedWorkDir}/'.encode('utf-8'), f'{currentWorkDir}/'.encode('utf-8'))
+
+        with gzip.open(f'{workDir}/{basename}.synctex.gz', 'wb') as f:
+            f.write(content)
+
+    def getPageKeys(self, key: str) -> List[str]:
+        # page cache keys of the rasterized pages, in page order
+        try:
+            with open(f'{self.getFolder(key)}/{self.rasterName}/pages.json', 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def storePageKeys(self, key: str, pageKeys: List[str]) -> None:
+        folder = f'{self.getFolder(key)}/{self.rasterName}'
+        os.makedirs(folder, exist_ok=True)
+
+        tmpFile = f'{folder}/pages.json.tmp-{uuid.uuid4().hex}'
+        with open(tmpFile, 'w') as f:
+            json.dump(pageKeys, f)
+        os.replace(tmpFile, f'{folder}/pages.json')
+
+
+    def storeFile(self, source: str, target: str) -> None:
+        # copy to a temporary file first so that concurrent readers never see partial files
+        tmpFile = f'{target}.tmp-{uuid.uuid4().hex}'
+        shutil.copyfile(source, tmpFile)
+        os.replace(tmpFile, target)
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from tex_timelapse.snapshot import Snapshot
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    commit_sha TEXT PRIMARY KEY,
+    idx INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    changed_lines TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_idx ON snapshots (idx);
+CREATE TABLE IF NOT EXISTS broken_ranges (
+    first_sha TEXT NOT NULL,
+    last_sha TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (first_sha, last_sha, fingerprint)
+);
+'''
+
+# Stores snapshots in a SQLite database inside the project folder. Snapshots are written one by one
+# as they complete, so that a crash only loses the snapshots that were in progress.
+# Changed lines are stored in their own column, as they are by far the largest part and rarely needed.
+class SnapshotStore:
+    def __init__(self, projectFolder: str):
+        self.projectFolder = projectFolder
+        self.dbFile = f'{projectFolder}/snapshots.db'
+        self.lock = threading.Lock()
+
+        isNew = not os.path.exists(self.dbFile)
+        self.connection = sqlite3.connect(self.dbFile, check_same_thread=False)
+        # write ahead log: readers (e.g. the web UI) are not blocked while a run writes snapshots
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+        if isNew:
+            self.migrate()
+
+    def migrate(self) -> None:
+        # import snapshots.yaml from earlier versions, the file is kept as a backup
+        yamlFile = f'{self.projectFolder}/snapshots.yaml'
+        if not os.path.exists(yamlFile):
+            return
+
+        self.upsertMany(Snapshot.deserialize(yamlFile))
+        os.replace(yamlFile, f'{yamlFile}.migrated')
+        print(f'Migrated {yamlFile} to {self.dbFile}')
+
+    def upsert(self, snapshot: Snapshot) -> None:
+        self.upsertMany([snapshot])
+
+    def upsertMany(self, snapshots: List[Snapshot]) -> None:
+        rows = []
+        for snapshot in snapshots:
+            data = snapshot.to_record()
+            changedLines = data.pop('changed_lines')
+            rows.append((snapshot.commit_sha, snapshot.index, snapshot.status, json.dumps(data), json.dumps(changedLines)))
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO snapshots (commit_sha, idx, status, data, changed_lines) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (commit_sha) DO UPDATE SET idx = excluded.idx, status = excluded.status, data = excluded.data, changed_lines = excluded.changed_lines',
+                rows
+            )
+
+    def load(self, includeChangedLines: bool = True, offset: int = 0, limit: int = -1) -> List[Snapshot]:
+        columns = 'data, changed_lines' if includeChangedLines else 'data'
+        with self.lock:
+            rows = self.connection.execute(f'SELECT {columns} FROM snapshots ORDER BY idx LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+
+        return [self.toSnapshot(row) for row in rows]
+
+    def get(self, commit_sha: str, includeChangedLines: bool = True) -> Optional[Snapshot]:
+        columns = 'data, changed_lines' if includeChangedLines else 'data'
+        with self.lock:
+            row = self.connection.execute(f'SELECT {columns} FROM snapshots WHERE commit_sha = ?', (commit_sha,)).fetchone()
+
+        return self.toSnapshot(row) if row is not None else None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+
+    def toSnapshot(self, row: tuple) -> Snapshot:
+        data: Dict[str, Any] = json.loads(row[0])
+        if len(row) > 1:
+            data['changed_lines'] = json.loads(row[1])
+
+        return Snapshot.from_record(data)
+
+    def addBrokenRange(self, first_sha: str, last_sha: str, fingerprint: str) -> None:
+        # commits from first_sha to last_sha (inclusive) are known to fail with the config of the fingerprint
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO broken_ranges (first_sha, last_sha, fingerprint) VALUES (?, ?, ?)',
+                                    (first_sha, last_sha, fingerprint))
+
+    def getBrokenRanges(self, fingerprint: str) -> List[Tuple[str, str]]:
+        with self.lock:
+            return self.connection.execute('SELECT first_sha, last_sha FROM broken_ranges WHERE fingerprint = ?', (fingerprint,)).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @staticmethod
+    def remove(projectFolder: str) -> None:
+        for file in ['snapshots.db', 'snapshots.db-wal', 'snapshots.db-shm', 'snapshots.yaml']:
+            if os.path.exists(f'{projectFolder}/{file}'):
+                os.remove(f'{projectFolder}/{file}')
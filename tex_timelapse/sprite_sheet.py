@@ -0,0 +1,55 @@
+import json
+import math
+import os
+import uuid
+from glob import glob
+from typing import Any, Dict
+from PIL import Image
+
+SPRITE_IMAGE = 'sprite.jpg'
+SPRITE_MAP = 'sprite.json'
+# pages per row of the sprite sheet, keeps the image well below the maximum jpeg size for long documents
+SPRITE_COLUMNS = 10
+
+# Combines the page thumbnails of a snapshot into a single image, so that the web UI can load all
+# pages with one request. The offset map lists the position of each page inside the sprite sheet.
+def createSpriteSheet(folder: str) -> Dict[str, Any]:
+    thumbnails = sorted(file for file in glob(f'{folder}/*.jpg') if os.path.basename(file) != SPRITE_IMAGE)
+
+    images = [Image.open(file) for file in thumbnails]
+    try:
+        cellWidth = max((img.width for img in images), default=0)
+        cellHeight = max((img.height for img in images), default=0)
+        columns = min(len(images), SPRITE_COLUMNS)
+        rows = math.ceil(len(images) / SPRITE_COLUMNS)
+
+        sprite = Image.new('RGB', (max(1, columns * cellWidth), max(1, rows * cellHeight)), 'white')
+        pages = []
+        for i, (file, img) in enumerate(zip(thumbnails, images)):
+            x, y = (i % SPRITE_COLUMNS) * cellWidth, (i // SPRITE_COLUMNS) * cellHeight
+            sprite.paste(img, (x, y))
+            pages.append({ 'name': os.path.basename(file), 'x': x, 'y': y, 'width': img.width, 'height': img.height })
+    finally:
+        for img in images:
+            img.close()
+
+    spriteMap = { 'width': sprite.width, 'height': sprite.height, 'pages': pages }
+
+    # written to temporary files first, as the web server may create the same sprite sheet concurrently
+    tmpSuffix = f'.tmp-{uuid.uuid4().hex}'
+    sprite.save(f'{folder}/{SPRITE_IMAGE}{tmpSuffix}', 'JPEG', quality=85)
+    with open(f'{folder}/{SPRITE_MAP}{tmpSuffix}', 'w') as f:
+        json.dump(spriteMap, f)
+
+    # the map is moved last, as its existence marks the sprite sheet as complete
+    os.replace(f'{folder}/{SPRITE_IMAGE}{tmpSuffix}', f'{folder}/{SPRITE_IMAGE}')
+    os.replace(f'{folder}/{SPRITE_MAP}{tmpSuffix}', f'{folder}/{SPRITE_MAP}')
+    return spriteMap
+
+def loadSpriteSheet(folder: str) -> Dict[str, Any]:
+    # thumbnails of earlier versions have no sprite sheet yet
+    try:
+        with open(f'{folder}/{SPRITE_MAP}', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return createSpriteSheet(folder)
@@ -0,0 +1,229 @@
+import gzip
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+# record types (first character of a line in the synctex content section)
+BOX_OPEN = { '[', '(' }
+BOX_CLOSE = { ']', ')' }
+VOID_BOX = { 'v', 'h' }
+NODE = { 'k', 'g', '$', 'x', 'r' }
+
+# sp -> bp (1bp = 65781.76sp)
+SP_PER_BP = 65781.76
+
+class SynctexNode:
+    __slots__ = ('page', 'tag', 'line', 'h', 'v', 'W', 'H', 'D', 'box')
+
+    def __init__(self, page: int, tag: int, line: int, h: float, v: float, W: float, H: float, D: float):
+        self.page = page
+        self.tag = tag
+        self.line = line
+        self.h = h
+        self.v = v
+        self.W = W
+        self.H = H
+        self.D = D
+        # enclosing box that is reported for this node (the node itself for boxes)
+        self.box: Optional['SynctexNode'] = None
+
+
+# Reads a .synctex(.gz) file once and answers (file, line) -> (page, box) queries in memory,
+# producing the same values as 'synctex view -i line:0:file -o pdf'
+class SynctexIndex:
+    def __init__(self, synctexFile: str, workDir: str):
+        self.workDir = os.path.abspath(workDir)
+        self.inputs: Dict[int, str] = {}
+        self.nodes: Dict[Tuple[str, int], List[SynctexNode]] = {}
+        self.maxLine: Dict[str, int] = {}
+
+        self.unit = 1.0
+        self.magnification = 1000.0
+        self.postMagnification = 0.0
+        self.xOffset = 0.0
+        self.yOffset = 0.0
+
+        opener = gzip.open if synctexFile.endswith('.gz') else open
+        with opener(synctexFile, 'rb') as f:
+            self.parse(f.read().decode('utf-8', errors='replace').splitlines())
+
+    @staticmethod
+    def find(workDir: str, texFile: str) -> Optional[str]:
+        basename = f'{workDir}/{texFile[:-4]}'
+        for synctexFile in [f'{basename}.synctex.gz', f'{basename}.synctex']:
+            if os.path.exists(synctexFile):
+                return synctexFile
+        return None
+
+
+    def parse(self, lines: List[str]) -> None:
+        page = 0
+        boxes: List[SynctexNode] = []
+        values = [0.0] * 5
+        inContent = False
+
+        for line in lines:
+            if line == '':
+                continue
+
+            if line.startswith('Input:'):
+                # inputs may also be declared in between the content
+                _, tag, path = line.split(':', 2)
+                self.inputs[int(tag)] = self.normalizePath(path)
+                continue
+
+            if not inContent:
+                if line.startswith('Unit:'):
+                    self.unit = float(line[5:])
+                elif line.startswith('Magnification:'):
+                    self.magnification = float(line[14:])
+                elif line.startswith('Content:'):
+                    inContent = True
+                continue
+
+            if line.startswith('Postamble:'):
+                break
+
+            kind = line[0]
+            if kind == '{':
+                page = int(line[1:])
+                boxes = []
+            elif kind == '}':
+                boxes = []
+            elif kind in BOX_CLOSE:
+                if len(boxes) > 0:
+                    boxes.pop()
+            elif kind in BOX_OPEN or kind in VOID_BOX or kind in NODE:
+                node = self.parseNode(line, page, values)
+                if node is None:
+                    continue
+
+                if kind in NODE:
+                    node.box = boxes[-1] if len(boxes) > 0 else node
+                else:
+                    node.box = node
+
+                if kind in BOX_OPEN:
+                    boxes.append(node)
+
+                self.addNode(node)
+
+        self.parsePostScriptum(lines)
+
+    def parsePostScriptum(self, lines: List[str]) -> None:
+        # 'Magnification:' and 'X/Y Offset:' after 'Post scriptum:' override the output settings
+        postScriptum = False
+        for line in lines:
+            if line.startswith('Post scriptum:'):
+                postScriptum = True
+            elif postScriptum and line.startswith('Magnification:'):
+                self.postMagnification = float(line[14:])
+            elif postScriptum and line.startswith('X Offset:'):
+                self.xOffset = float(line[9:]) / SP_PER_BP
+            elif postScriptum and line.startswith('Y Offset:'):
+                self.yOffset = float(line[9:]) / SP_PER_BP
+
+    def parseNode(self, line: str, page: int, values: List[float]) -> Optional[SynctexNode]:
+        # format: <type><tag>,<line>[,<column>]:<h>,<v>[:<W>[,<H>,<D>]]
+        try:
+            parts = line[1:].split(':')
+            link = parts[0].split(',')
+            tag, lineNumber = int(link[0]), int(link[1])
+
+            numbers = []
+            for part in parts[1:]:
+                numbers.extend(part.split(','))
+        except (ValueError, IndexError):
+            return None
+
+        # '=' repeats the value of the previous record
+        for i, number in enumerate(numbers[:5]):
+            if number != '=':
+                values[i] = float(number)
+
+        count = len(numbers)
+        return SynctexNode(
+            page, tag, lineNumber,
+            values[0], values[1],
+            values[2] if count > 2 else 0.0,
+            values[3] if count > 3 else 0.0,
+            values[4] if count > 4 else 0.0,
+        )
+
+    def addNode(self, node: SynctexNode) -> None:
+        file = self.inputs.get(node.tag)
+        if file is None:
+            return
+
+        key = (file, node.line)
+        if key not in self.nodes:
+            self.nodes[key] = []
+        self.nodes[key].append(node)
+        self.maxLine[file] = max(self.maxLine.get(file, 0), node.line)
+
+    def normalizePath(self, path: str) -> str:
+        if not os.path.isabs(path):
+            path = os.path.join(self.workDir, path)
+        path = os.path.normpath(path)
+        if path.startswith(self.workDir + os.sep):
+            path = os.path.relpath(path, self.workDir)
+        return path
+
+
+    def getScale(self) -> float:
+        scale = self.unit / SP_PER_BP
+        if self.postMagnification > 0:
+            scale *= self.postMagnification
+        return scale * self.magnification / 1000.0
+
+    def findNodes(self, file: str, line: int) -> List[SynctexNode]:
+        file = self.normalizePath(file)
+        maxLine = self.maxLine.get(file, 0)
+        if maxLine == 0:
+            return []
+
+        # like synctex, fall back to the closest line that produced any output
+        line = min(line, maxLine)
+        for distance in range(0, maxLine + 1):
+            for candidate in [line + distance, line - distance]:
+                nodes = self.nodes.get((file, candidate))
+                if nodes:
+                    # only report results on the first page the line appears on
+                    page = min(node.page for node in nodes)
+                    return [node for node in nodes if node.page == page]
+        return []
+
+    def lookup(self, file: str, line: int) -> List[dict]:
+        scale = self.getScale()
+        results = []
+        seenBoxes: Set[int] = set()
+
+        for node in self.findNodes(file, line):
+            box = node.box if node.box is not None else node
+
+            # report each enclosing box only once
+            if id(box) in seenBoxes:
+                continue
+            seenBoxes.add(id(box))
+
+            h, W = box.h, box.W
+            if W < 0:
+                h, W = h + W, -W
+
+            results.append({
+                'page': node.page,
+                'x': node.h * scale + self.xOffset,
+                'y': node.v * scale + self.yOffset,
+                'h': h * scale + self.xOffset,
+                'v': (box.v + box.D) * scale + self.yOffset,
+                'W': W * scale,
+                'H': (box.H + box.D) * scale,
+            })
+
+        return results
+
+    def lookupAll(self, changedFiles: Dict[str, Set[int]]) -> List[dict]:
+        results = []
+        for file, changedLines in changedFiles.items():
+            for line in sorted(changedLines):
+                results.extend(self.lookup(file, line))
+        return results
@@ -1,15 +1,28 @@
 from os import path
+import gzip
+import json
 import os
 from shutil import rmtree
-from flask import Flask, jsonify, send_file
+from typing import Any
+from flask import Flask, Response, jsonify, send_from_directory
 from flask import request
 from flask_socketio import SocketIO # type: ignore
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import secure_filename
+
+try:
+    import brotli # type: ignore
+except ImportError:
+    brotli = None
 
 from tex_timelapse.reporters.web_reporter import WebReporter
 from tex_timelapse.compiler import compileProject, compileSnapshot
+from tex_timelapse.job_manager import Job, JobManager, JobStatus
 from tex_timelapse.project import Project
-from tex_timelapse.snapshot import Snapshot
+from tex_timelapse.project_cache import projectCache
+from tex_timelapse.snapshot_store import SnapshotStore
+from tex_timelapse.sprite_sheet import SPRITE_IMAGE, SPRITE_MAP, loadSpriteSheet
 
 from .actions.init_repo import InitRepoAction
 from .actions.replace_text import ReplaceTextAction
@@ -17,12 +30,38 @@ from .actions.compile_latex import CompileLatexAction
 from .actions.pdf_to_image import PdfToImageAction
 from .actions.assemble_image import AssembleImageAction
 
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+# one year, versioned thumbnail urls never change their content
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+def jsonResponse(data: Any, etag: str) -> Response:
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    response = Response(mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encodings = request.accept_encodings
+        if brotli is not None and encodings['br']:
+            body = brotli.compress(body, quality=5)
+            response.content_encoding = 'br'
+        elif encodings['gzip']:
+            body = gzip.compress(body, compresslevel=6)
+            response.content_encoding = 'gzip'
+
+    response.set_data(body)
+    return response
+
 class WebServer:
     def __init__(self):
         self.app = Flask(__name__)
 
         CORS(self.app, resources={r"/*": {"origins": "*"}})
         self.socketio = SocketIO(self.app, cors_allowed_origins='*')
+        # runs are executed in the background, one at a time per project
+        self.jobManager = JobManager(lambda job: self.socketio.emit('job', job.to_dict()))
 
         @self.app.route('/api/projects')
         def listProjects():
@@ -34,11 +73,60 @@ class WebServer:
         @self.app.route('/api/projects/<name>', methods=['GET'])
         def __getProject(name):
             try :
-                project = Project.deserialize(name)
+                etag = projectCache.getEtag(name)
+                if request.if_none_match.contains(etag):
+                    return Response(status=304)
+
+                project = projectCache.getProject(name)
                 project_dict = project.to_dict()
-                project.loadSnapshots()
-                project_dict['snapshots'] = [snapshot.to_dict() for snapshot in project.snapshots]
-                return { 'success': True, 'project': project_dict }
+                project_dict['snapshots'] = projectCache.getSnapshotDicts(name)
+                return jsonResponse({ 'success': True, 'project': project_dict }, etag)
+            except Exception as e:
+                return { 'success': False, 'error': str(e) }
+
+        @self.app.route('/api/projects/<name>/snapshots', methods=['GET'])
+        def __listSnapshots(name):
+            # e.g. ?offset=0&limit=100&fields=commit_sha,commit_date,status
+            try:
+                offset = max(int(request.args.get('offset', 0)), 0)
+                limit = int(request.args.get('limit', -1))
+                fields = [field for field in request.args.get('fields', '').split(',') if field != '']
+
+                etag = projectCache.getEtag(name, request.query_string.decode('utf-8'))
+                if request.if_none_match.contains(etag):
+                    return Response(status=304)
+
+                # only the requested rows are read from the snapshot database
+                store = projectCache.getProject(name).openSnapshotStore()
+                try:
+                    total = store.count()
+                    page = [snapshot.to_dict(includeChangedLines=False) for snapshot in store.load(False, offset, limit)]
+                finally:
+                    store.close()
+
+                if len(fields) > 0:
+                    page = [{ field: snapshot[field] for field in fields if field in snapshot } for snapshot in page]
+
+                return jsonResponse({ 'success': True, 'total': total, 'offset': offset, 'snapshots': page }, etag)
+            except Exception as e:
+                return { 'success': False, 'error': str(e) }
+
+        @self.app.route('/api/projects/<name>/snapshot/<snapshot_sha>', methods=['GET'])
+        def __getSnapshot(name, snapshot_sha):
+            try:
+                etag = projectCache.getEtag(name, snapshot_sha)
+                if request.if_none_match.contains(etag):
+                    return Response(status=304)
+
+                store = projectCache.getProject(name).openSnapshotStore()
+                try:
+                    snapshot = store.get(snapshot_sha)
+                finally:
+                    store.close()
+                if snapshot is None:
+                    return { 'success': False, 'error': 'Snapshot not found' }
+
+                return jsonResponse({ 'success': True, 'snapshot': snapshot.to_dict() }, etag)
             except Exception as e:
                 return { 'success': False, 'error': str(e) }
 
@@ -50,6 +138,7 @@ class WebServer:
                     if 'config' in request.json:
                         project.config = request.json['config']
                         project.serialize()
+                        projectCache.invalidate(name)
                     # TODO: support name change
                     return jsonify({ 'success': True })
 
@@ -61,20 +150,30 @@ class WebServer:
         @self.app.route('/api/projects/<name>/run')
         def __runProject(name):
             try:
-                project = Project.deserialize(name)
-                project.loadSnapshots()
-
-                jobs = [
-                    InitRepoAction(),
-                    ReplaceTextAction(),
-                    CompileLatexAction(),
-                    PdfToImageAction(),
-                    AssembleImageAction()
-                ]
-
-                compileProject(project, 'test', jobs, WebReporter(self.socketio))
-
-                return { 'success': True }
+                # fail early if the project does not exist
+                Project.deserialize(name)
+
+                def run(job: Job):
+                    project = Project.deserialize(name)
+                    project.loadSnapshots()
+
+                    jobs = [
+                        InitRepoAction(),
+                        ReplaceTextAction(),
+                        CompileLatexAction(),
+                        PdfToImageAction(),
+                        AssembleImageAction()
+                    ]
+
+                    reporter = WebReporter(self.socketio, project.config.get('progressInterval', 0.5))
+                    try:
+                        compileProject(project, 'test', jobs, reporter, job.token)
+                    finally:
+                        reporter.flush()
+                        projectCache.invalidate(name)
+
+                job = self.jobManager.submit(name, 'run', run)
+                return { 'success': True, 'job': job.to_dict() }
             except Exception as e:
                 return { 'success': False, 'error': str(e) }
 
@@ -86,8 +185,9 @@ class WebServer:
                 # todo: handle this in a more central location
                 rmtree(f'{project.projectFolder}/images', ignore_errors=True)
                 rmtree(f'{project.projectFolder}/thumbnails', ignore_errors=True)
-                if os.path.exists(f'{project.projectFolder}/snapshots.yaml'):
-                    os.remove(f'{project.projectFolder}/snapshots.yaml')
+                rmtree(f'{project.projectFolder}/cache', ignore_errors=True)
+                SnapshotStore.remove(project.projectFolder)
+                projectCache.invalidate(name)
 
                 return { 'success': True }
             except Exception as e:
@@ -97,41 +197,116 @@ class WebServer:
         @self.app.route('/api/projects/<name>/snapshot/<snapshot_sha>/run')
         def __compileSnapshot(name, snapshot_sha):
             try:
-                project = Project.deserialize(name)
-                project.loadSnapshots()
-                matching_snapshot = [s for s in project.snapshots if s.commit_sha == snapshot_sha]
-
-                jobs = [
-                    InitRepoAction(),
-                    ReplaceTextAction(),
-                    CompileLatexAction(),
-                    PdfToImageAction(),
-                    AssembleImageAction()
-                ]
-
-
-                if len(matching_snapshot) == 0:
-                    return { 'success': False, 'error': 'Snapshot not found' }
-
-                compileSnapshot(project, matching_snapshot[0], jobs, WebReporter(self.socketio))
-                Snapshot.serialize(f'{project.projectFolder}/snapshots.yaml', project.snapshots)
-
-                return { 'success': True }
+                def run(job: Job):
+                    # loaded inside the job, so that results of an earlier run of the project are included
+                    project = Project.deserialize(name)
+                    project.loadSnapshots()
+                    matching_snapshot = [s for s in project.snapshots if s.commit_sha == snapshot_sha]
+
+                    jobs = [
+                        InitRepoAction(),
+                        ReplaceTextAction(),
+                        CompileLatexAction(),
+                        PdfToImageAction(),
+                        AssembleImageAction()
+                    ]
+
+                    if len(matching_snapshot) == 0:
+                        raise Exception('Snapshot not found')
+
+                    # explicitly requested, so re-run all stages even if nothing changed
+                    matching_snapshot[0].fingerprints = {}
+                    reporter = WebReporter(self.socketio, project.config.get('progressInterval', 0.5))
+                    compileSnapshot(project, matching_snapshot[0], jobs, reporter)
+                    reporter.flush()
+
+                    store = project.openSnapshotStore()
+                    store.upsert(matching_snapshot[0])
+                    store.close()
+                    projectCache.invalidate(name)
+                    return matching_snapshot[0].to_dict()
+
+                # a single snapshot is quick, but must neither run concurrently with a run of the whole project
+                # nor keep the request waiting until such a run is finished
+                job = self.jobManager.submitIfIdle(name, 'snapshot', run)
+                if job is None:
+                    return { 'success': False, 'error': 'The project is already running' }
+                job.wait()
+                if job.status != JobStatus.COMPLETED:
+                    return { 'success': False, 'error': job.error or job.status, 'job': job.to_dict() }
+
+                return { 'success': True, 'job': job.to_dict(), 'snapshot': job.result }
             except Exception as e:
                 return { 'success': False, 'error': str(e) }
 
 
-        @self.app.route('/api/projects/<name>/snapshot/<snapshot>/image/<image>')
-        def getImage(name, snapshot, image):
+        @self.app.route('/api/jobs', methods=['GET'])
+        def __listJobs():
+            # e.g. ?project=thesis
+            jobs = self.jobManager.list(request.args.get('project'))
+            return { 'success': True, 'jobs': [job.to_dict() for job in jobs] }
+
+        @self.app.route('/api/jobs/<job_id>', methods=['GET'])
+        def __getJob(job_id):
+            job = self.jobManager.get(job_id)
+            if job is None:
+                return { 'success': False, 'error': 'Job not found' }
+            return { 'success': True, 'job': job.to_dict() }
+
+        @self.app.route('/api/jobs/<job_id>/cancel', methods=['GET', 'POST'])
+        def __cancelJob(job_id):
+            job = self.jobManager.cancel(job_id)
+            if job is None:
+                return { 'success': False, 'error': 'Job not found' }
+            return { 'success': True, 'job': job.to_dict() }
+
+
+        def getThumbnailFolder(name: str, snapshot_sha: str) -> str:
+            folder = f'{projectCache.getProject(name).projectFolder}/thumbnails/{secure_filename(snapshot_sha)}'
+            if not os.path.isdir(folder):
+                raise NotFound()
+            return folder
+
+        def sendThumbnail(name: str, snapshot_sha: str, image: str) -> Response:
+            project = projectCache.getProject(name)
+            folder = path.join(os.getcwd(), project.projectFolder, 'thumbnails')
+            # send_from_directory rejects paths outside of the folder and answers conditional requests with 304
+            response = send_from_directory(folder, f'{secure_filename(snapshot_sha)}/{secure_filename(image)}', etag=True, conditional=True)
+
+            # thumbnails only change when the snapshot is rendered again, which changes its thumbnails_version
+            if request.args.get('v'):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = THUMBNAIL_MAX_AGE
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.no_cache = True
+            return response
+
+        @self.app.route('/api/projects/<name>/snapshot/<snapshot_sha>/image/<image>')
+        def getImage(name, snapshot_sha, image):
+            # e.g. ?v=<thumbnails_version>
             try:
-                project = Project.deserialize(name)
-                # TODO: sanitize snapshot and image
-                filePath = path.join(os.getcwd(), project.projectFolder, 'thumbnails', snapshot, image)
-                print(filePath)
-                return send_file(filePath)
-            except Exception as e:
-                filePath = path.join(os.getcwd(), project.projectFolder, 'thumbnails', snapshot, image)
-                return str(e)
+                return sendThumbnail(name, snapshot_sha, image)
+            except NotFound:
+                return Response('Image not found', status=404)
+
+        @self.app.route('/api/projects/<name>/snapshot/<snapshot_sha>/sprite')
+        def __getSprite(name, snapshot_sha):
+            # all page thumbnails in one image, see /sprite.json for the position of each page
+            try:
+                loadSpriteSheet(getThumbnailFolder(name, snapshot_sha))
+                return sendThumbnail(name, snapshot_sha, SPRITE_IMAGE)
+            except (NotFound, FileNotFoundError):
+                return Response('Sprite sheet not found', status=404)
+
+        @self.app.route('/api/projects/<name>/snapshot/<snapshot_sha>/sprite.json')
+        def __getSpriteMap(name, snapshot_sha):
+            try:
+                loadSpriteSheet(getThumbnailFolder(name, snapshot_sha))
+                return sendThumbnail(name, snapshot_sha, SPRITE_MAP)
+            except (NotFound, FileNotFoundError):
+                return Response('Sprite sheet not found', status=404)
 
 
         UPLOAD_FOLDER = 'uploads'
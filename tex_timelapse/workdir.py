@@ -0,0 +1,59 @@
+import fcntl
+import os
+import subprocess
+from shutil import rmtree
+from typing import IO, Optional, Tuple
+
+from tex_timelapse.project import Project
+
+def initFolder(project: Project, id: int) -> str:
+    workDir = f"{project.projectFolder}/workdir/{id}"
+
+    if not os.path.exists(f'{workDir}/.git'):
+        # work dirs are git worktrees of the source repository, so they share a single object database
+        with open(f'{project.projectFolder}/workdir/.lock', 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            rmtree(workDir, ignore_errors=True)
+
+            source = f'{project.projectFolder}/source'
+            for cmd in [['git', 'worktree', 'prune'], ['git', 'worktree', 'add', '--detach', '--no-checkout', '--force', os.path.abspath(workDir)]]:
+                output = subprocess.run(cmd, cwd=source, capture_output=True, text=True)
+                if output.returncode != 0:
+                    raise Exception(f'"{" ".join(cmd)}" failed with error: {output.stderr}')
+
+    return workDir
+
+def lockSlot(project: Project, slot: int) -> Optional[IO]:
+    lockFile = open(f'{project.projectFolder}/workdir/{slot}.lock', 'w')
+    try:
+        fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lockFile
+    except BlockingIOError:
+        lockFile.close()
+        return None
+
+def leaseWorkDir(project: Project, preferredSlot: int = 0) -> Tuple[str, IO]:
+    # work dirs are kept for following snapshots (and following runs). Lock files make sure
+    # that threads and processes never use the same work dir at the same time
+    os.makedirs(f'{project.projectFolder}/workdir', exist_ok=True)
+
+    # the preferred work dir still contains the latex aux files of a nearby commit
+    slot = preferredSlot
+    lockFile = lockSlot(project, slot)
+    if lockFile is None:
+        slot = 0
+        while True:
+            lockFile = lockSlot(project, slot) if slot != preferredSlot else None
+            if lockFile is not None:
+                break
+            slot += 1
+
+    try:
+        return initFolder(project, slot), lockFile
+    except Exception:
+        lockFile.close()
+        raise
+
+def releaseWorkDir(lockFile: IO) -> None:
+    # closing the lock file releases the lock
+    lockFile.close()
@@ -1,5 +1,5 @@
 import { TimelapseProject } from '@/models/project';
-import { TimelapseSnapshot } from '@/models/snapshot';
+import { SpriteMap, TimelapseSnapshot } from '@/models/snapshot';
 import {
     Alert,
     AlertDescription,
@@ -14,7 +14,7 @@ import { Slider } from '@/components/ui/slider';
 import { AlertCircle, Settings } from 'lucide-react';
 import './snapshot-pages.scss';
 import { Button } from '@/components/ui/button';
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 
 export interface SnapshotPagesProps {
     project: TimelapseProject,
@@ -24,6 +24,24 @@ export interface SnapshotPagesProps {
 
 export const SnapshotPages = (props: SnapshotPagesProps) => {
     const [ pageWidth, setPageWidth ] = useState([400]);
+    const [ spriteMap, setSpriteMap ] = useState<SpriteMap | null>(null);
+
+    // versioned urls are cached by the browser, so scrubbing through snapshots only loads each sprite sheet once
+    const snapshotUrl = `/api/projects/${props.project.name}/snapshot/${props.snapshot.commit_sha}`;
+    const version = props.snapshot.thumbnails_version;
+
+    useEffect(() => {
+        setSpriteMap(null);
+        if (props.snapshot.status !== 'Completed' || !version) return;
+
+        let cancelled = false;
+        fetch(`${snapshotUrl}/sprite.json?v=${version}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(map => { if (!cancelled) setSpriteMap(map); })
+            .catch(() => { if (!cancelled) setSpriteMap(null); });
+
+        return () => { cancelled = true; };
+    }, [snapshotUrl, version, props.snapshot.status]);
 
     const status = props.snapshot.status;
     if (status && status === 'Completed') {
@@ -43,17 +61,28 @@ export const SnapshotPages = (props: SnapshotPagesProps) => {
 
             // extract the page from the path
             const pageName = page.split('/').pop();
+            const sprite = spriteMap?.pages.find(p => p.name === pageName);
 
             return (
                 <div className='snapshot-page-preview' key={page} style={{ 'width': `${pageWidth}px` }}>
                     {pageChanged && <div className='snapshot-page-changed' />}
                     {detailChanges}
 
-                    <img src={`/api/projects/${props.project.name}/snapshot/${props.snapshot.commit_sha}/image/${pageName}`}
-                        className='max-w-full'
-                        style={{ 'filter': `blur(${props.blur}px)` }}
-                        alt={`Page ${index}`}
-                    />
+                    {sprite ?
+                        <div role='img' aria-label={`Page ${index}`} className='max-w-full' style={{
+                            'aspectRatio': `${sprite.width} / ${sprite.height}`,
+                            'backgroundImage': `url(${snapshotUrl}/sprite?v=${version})`,
+                            'backgroundSize': `${spriteMap!.width / sprite.width * 100}% ${spriteMap!.height / sprite.height * 100}%`,
+                            'backgroundPosition': `${spriteMap!.width === sprite.width ? 0 : sprite.x / (spriteMap!.width - sprite.width) * 100}% ` +
+                                `${spriteMap!.height === sprite.height ? 0 : sprite.y / (spriteMap!.height - sprite.height) * 100}%`,
+                            'filter': `blur(${props.blur}px)`
+                        }} /> :
+                        <img src={`${snapshotUrl}/image/${pageName}?v=${version}`}
+                            className='max-w-full'
+                            style={{ 'filter': `blur(${props.blur}px)` }}
+                            alt={`Page ${index}`}
+                        />
+                    }
                 </div>
             );
         }
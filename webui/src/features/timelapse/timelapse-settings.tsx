@@ -100,8 +100,8 @@ export const TimelapseSettings = ({ project }: TimelapseSettingsProps) => {
         const success = await fetch(`/api/projects/${project.name}/run`);
 
         if (success) {
-            toast.success('Video created', {
-                description: 'Project rendered successfully',
+            toast.success('Rendering started', {
+                description: 'Project is rendered in the background',
             });
         } else {
             toast.error('Rendering error', {
@@ -5,8 +5,16 @@ export type TimelapseSnapshot = {
     'status': 'In Progress' | 'Completed' | 'Failed' | 'Unknown';
     'error': string;
     'includes': string[],
-    'gitDiff': string,
+    // only included by /api/projects/<name>/snapshot/<sha>
+    'changed_lines'?: { [file: string]: [number, number][] },
     'changed_pages': { page: number, x1: number, y1: number, x2: number, y2: number }[],
     'pages': [],
+    'thumbnails_version': string,
     'jobs': { [key: string]: 'In Progress' | 'Completed' | 'Failed' | 'Unknown' };
 }
+
+export type SpriteMap = {
+    'width': number,
+    'height': number,
+    'pages': { name: string, x: number, y: number, width: number, height: number }[]
+}
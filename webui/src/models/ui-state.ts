@@ -119,22 +119,35 @@ socket.on('stage', ({ stage, length }: { stage: string, length: number }) => {
     console.log('stage', stage, length);
 });
 
-socket.on('add_progress', ({ snapshot }: { snapshot: TimelapseSnapshot }) => {
-    // const project = UIState.project.value;
-    // if (project)
-    //     UIState.updateSnapshot(project, snapshot);
-    snapshotUpdates.next(snapshot);
-
-    if (UIState.project.value?.snapshots) {
-        const index = UIState.project.value.snapshots.findIndex(s => s.commit_sha === snapshot.commit_sha);
-        if (index !== -1) {
-            UIState.project.value.snapshots[index] = snapshot;
-            UIState.project.next(UIState.project.value);
+// latest applied update version per snapshot, older updates are skipped
+const snapshotVersions = new Map<string, number>();
+
+// versions only increase within one server process, a (re)connect may be to a restarted server
+socket.on('connect', () => snapshotVersions.clear());
+
+socket.on('snapshot_updates', ({ updates }: { updates: (Partial<TimelapseSnapshot> & { commit_sha: string, version: number })[] }) => {
+    const project = UIState.project.value;
+    let projectChanged = false;
+
+    for (const { version, ...update } of updates) {
+        if ((snapshotVersions.get(update.commit_sha) ?? 0) >= version) continue;
+        snapshotVersions.set(update.commit_sha, version);
+
+        const index = project?.snapshots?.findIndex(s => s.commit_sha === update.commit_sha) ?? -1;
+        if (!project || index === -1) continue;
+
+        const snapshot = { ...project.snapshots[index], ...update };
+        project.snapshots[index] = snapshot;
+        projectChanged = true;
+        snapshotUpdates.next(snapshot);
+
+        if (UIState.currentSnapshot.value?.commit_sha === snapshot.commit_sha) {
+            UIState.currentSnapshot.next(snapshot);
         }
     }
 
-    if (UIState.currentSnapshot.value?.commit_sha === snapshot.commit_sha) {
-        UIState.currentSnapshot.next(snapshot);
+    if (project && projectChanged) {
+        UIState.project.next(project);
     }
 });
 